@@ -20,8 +20,8 @@ interface TimeEntry {
 
 const TaskTimeEntries: React.FC<{ task: Task }> = ({ task }) => {
   const [timeEntries, setTimeEntries] = useState<TimeEntry[]>([]);
-  const [playing, setPlaying] = useState(false);
   const [playingTimeEntry, setPlayingTimeEntry] = useState<TimeEntry | null>(null);
+  const playing = playingTimeEntry !== null;
   const [elapsedMinutes, setElapsedMinutes] = useState(0);
 
   useEffect(() => {
@@ -29,17 +29,60 @@ const TaskTimeEntries: React.FC<{ task: Task }> = ({ task }) => {
     fetchTimeEntriesWithoutEndTime();
   }, [task]);
 
+  // Add or replace an entry by id, so the event for a change this client
+  // already applied from the response is a no-op.
+  const applyStarted = (timeEntry: TimeEntry) => {
+    if (timeEntry.task_id !== task.task_id) return;
+    setTimeEntries((entries) =>
+      entries.some((entry) => entry.time_entry_id === timeEntry.time_entry_id)
+        ? entries.map((entry) => entry.time_entry_id === timeEntry.time_entry_id ? timeEntry : entry)
+        : [...entries, timeEntry]);
+    setPlayingTimeEntry(timeEntry);
+  };
+
+  const applyStopped = (timeEntry: TimeEntry) => {
+    if (timeEntry.task_id !== task.task_id) return;
+    setTimeEntries((entries) => entries.map((entry) =>
+      entry.time_entry_id === timeEntry.time_entry_id ? timeEntry : entry));
+    setPlayingTimeEntry((current) =>
+      current && current.time_entry_id !== timeEntry.time_entry_id ? current : null);
+  };
+
+  // Follow starts and stops made by any client instead of refetching. Events
+  // sent while the stream was down are lost, so refetch when it (re)opens
+  // and when it fails.
+  useEffect(() => {
+    const events = new EventSource('/api/events');
+    const refetch = () => {
+      fetchTimeEntries();
+      fetchTimeEntriesWithoutEndTime();
+    };
+
+    events.addEventListener('open', refetch);
+    events.addEventListener('error', refetch);
+    events.addEventListener('time_entry.started', (event) => {
+      applyStarted(JSON.parse((event as MessageEvent).data));
+    });
+    events.addEventListener('time_entry.stopped', (event) => {
+      applyStopped(JSON.parse((event as MessageEvent).data));
+    });
+
+    return () => events.close();
+  }, [task]);
+
   useEffect(() => {
     let interval: NodeJS.Timeout;
 
-    if (playing) {
-      interval = setInterval(() => {
-        setElapsedMinutes((prevElapsedMinutes) => prevElapsedMinutes + 1);
-      }, 60000);
+    if (playing && playingTimeEntry) {
+      const update = () => setElapsedMinutes(calculateElapsedMinutes(playingTimeEntry.start_time));
+      update();
+      interval = setInterval(update, 60000);
+    } else {
+      setElapsedMinutes(0);
     }
 
     return () => clearInterval(interval);
-  }, [playing]);
+  }, [playing, playingTimeEntry]);
 
   const fetchTimeEntries = async () => {
     try {
@@ -54,9 +97,11 @@ const TaskTimeEntries: React.FC<{ task: Task }> = ({ task }) => {
     try {
       const response = await axios.get(`/api/time_entries/task/${task.task_id}/playing`);
       setPlayingTimeEntry(response.data);
-      setPlaying(true);
-      setElapsedMinutes(calculateElapsedMinutes(response.data.start_time));
     } catch (error) {
+      if (axios.isAxiosError(error) && error.response?.status === 404) {
+        setPlayingTimeEntry(null);
+        return;
+      }
       console.error('Failed to fetch time entries:', error);
     }
   };
@@ -64,8 +109,7 @@ const TaskTimeEntries: React.FC<{ task: Task }> = ({ task }) => {
   const addTimeEntry = async () => {
     try {
       const response = await axios.post(`/api/time_entries/${task.task_id}/start`);
-      setPlayingTimeEntry(response.data);
-      fetchTimeEntries();
+      applyStarted(response.data);
     } catch (error) {
       console.error('Failed to add time entry:', error);
     }
@@ -73,8 +117,8 @@ const TaskTimeEntries: React.FC<{ task: Task }> = ({ task }) => {
 
   const updateTimeEntry = async (timeEntryId: number | undefined) => {
     try {
-      await axios.put(`/api/time_entries/${timeEntryId}/stop`);
-      fetchTimeEntries();
+      const response = await axios.put(`/api/time_entries/${timeEntryId}/stop`);
+      applyStopped(response.data);
     } catch (error) {
       console.error('Failed to update time entry:', error);
     }
@@ -90,10 +134,6 @@ const TaskTimeEntries: React.FC<{ task: Task }> = ({ task }) => {
       // Start a new time entry
       await addTimeEntry();
     }
-
-    // Toggle the playing state
-    setPlaying(!playing);
-    setElapsedMinutes(0);
   };
 
   const calculateElapsedMinutes = (startTime: string): number => {
@@ -4,7 +4,7 @@ import { Modal, TextField, Button, Box, Typography } from '@mui/material';
 interface UpdateActivityModalProps {
   open: boolean;
   onClose: () => void;
-  onUpdateActivity: (name: string, original_estimate: number, remaining_hours: number, completed_hours: number) => void;
+  onUpdateActivity: (name: string, original_estimate: number) => void;
   activity: {
     name: string;
     original_estimate: number;
@@ -21,8 +21,6 @@ const UpdateActivityModal: React.FC<UpdateActivityModalProps> = ({
 }) => {
   const [newActivityName, setNewActivityName] = useState('');
   const [newActivityEstimate, setNewActivityEstimate] = useState<number | ''>('');
-  const [newRemainingHours, setNewRemainingHours] = useState<number | ''>('');
-  const [newCompletedHours, setNewCompletedHours] = useState<number | ''>('');
 
   const handleNewActivityNameChange = (event: React.ChangeEvent<HTMLInputElement>) => {
     setNewActivityName(event.target.value);
@@ -33,35 +31,16 @@ const UpdateActivityModal: React.FC<UpdateActivityModalProps> = ({
     setNewActivityEstimate(isNaN(value) ? '' : value);
   };
 
-  const handleNewRemainingHoursChange = (event: React.ChangeEvent<HTMLInputElement>) => {
-    const value = +event.target.value;
-    setNewRemainingHours(isNaN(value) ? '' : value);
-  };
-
-  const handleNewCompletedHoursChange = (event: React.ChangeEvent<HTMLInputElement>) => {
-    const value = +event.target.value;
-    setNewCompletedHours(isNaN(value) ? '' : value);
-  };
-
   const handleUpdateActivity = () => {
-    onUpdateActivity(
-      newActivityName,
-      Number(newActivityEstimate),
-      Number(newRemainingHours),
-      Number(newCompletedHours)
-    );
+    onUpdateActivity(newActivityName, Number(newActivityEstimate));
     setNewActivityName('');
     setNewActivityEstimate('');
-    setNewRemainingHours('');
-    setNewCompletedHours('');
   };
 
   const handleClose = () => {
     onClose();
     setNewActivityName('');
     setNewActivityEstimate('');
-    setNewRemainingHours('');
-    setNewCompletedHours('');
   };
 
   if (!activity) return null;
@@ -100,11 +79,13 @@ const UpdateActivityModal: React.FC<UpdateActivityModalProps> = ({
           fullWidth
           margin="normal"
         />
+        {/* Completed hours come from the time entries and remaining hours
+            from the estimate, so the server ignores values sent for them. */}
         <TextField
           label="Remaining Hours"
           type="number"
-          value={newRemainingHours || activity.remaining_hours}
-          onChange={handleNewRemainingHoursChange}
+          value={activity.remaining_hours}
+          InputProps={{ readOnly: true }}
           variant="outlined"
           fullWidth
           margin="normal"
@@ -112,8 +93,8 @@ const UpdateActivityModal: React.FC<UpdateActivityModalProps> = ({
         <TextField
           label="Completed Hours"
           type="number"
-          value={newCompletedHours || activity.completed_hours}
-          onChange={handleNewCompletedHoursChange}
+          value={activity.completed_hours}
+          InputProps={{ readOnly: true }}
           variant="outlined"
           fullWidth
           margin="normal"
@@ -0,0 +1,200 @@
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+
+from database import Activity, DailyRollup, Task, TimeEntry
+from models import *
+from rollups import detach_tasks, rebuild_daily_rollups, reconcile
+
+# Batch mutations: every operation runs on the same session and the whole
+# batch is committed once. Task durations, activity hours and daily rollups
+# are recomputed once per affected activity, at the end or in a background
+# job, instead of after every operation.
+
+
+class Batch:
+    def __init__(self, db):
+        self.db = db
+        # Changed activities, each with the tasks whose time entries changed.
+        self.changes = {}
+
+    def touch(self, activity_id, task_id=None):
+        task_ids = self.changes.setdefault(activity_id, set())
+        if task_id is not None:
+            task_ids.add(task_id)
+
+    def get_activity(self, activity_id):
+        activity = self.db.query(Activity).get(activity_id)
+        if not activity:
+            raise HTTPException(status_code=404, detail="Activity not found")
+        return activity
+
+    def get_task(self, task_id):
+        task = self.db.query(Task).options(joinedload(Task.activity)).get(task_id)
+        if not task:
+            raise HTTPException(status_code=404, detail="Task not found")
+        return task
+
+    def create_activity(self, _, activity: ActivityCreate):
+        new_activity = Activity(
+            name=activity.name,
+            original_estimate=activity.original_estimate,
+            remaining_hours=activity.original_estimate,
+            completed_hours=0.0,
+            finalized=False
+        )
+        self.db.add(new_activity)
+        return new_activity
+
+    def update_activity(self, activity_id, activity: ActivityUpdate):
+        db_activity = self.get_activity(activity_id)
+        db_activity.name = activity.name
+        db_activity.original_estimate = activity.original_estimate
+        # completed_hours follows the time entries, so the client's value is
+        # ignored; remaining_hours is derived from the stored one in SQL.
+        db_activity.remaining_hours = activity.original_estimate - func.coalesce(Activity.completed_hours, 0)
+        db_activity.finalized = activity.finalized
+        db_activity.price_per_hour = activity.price_per_hour
+        db_activity.money_received = activity.money_received
+        return db_activity
+
+    def delete_activity(self, activity_id, _):
+        activity = self.get_activity(activity_id)
+        detach_tasks(self.db, activity_id)
+        self.db.delete(activity)
+
+    def create_task(self, _, task: TaskCreate):
+        activity = self.get_activity(task.activity_id)
+        if activity.finalized == True:
+            raise HTTPException(
+                status_code=400, detail="You can't create a task with finalized activity")
+        new_task = Task(activity_id=task.activity_id, name=task.name, duration=0.0)
+        self.db.add(new_task)
+        return new_task
+
+    def update_task(self, task_id, task: TaskUpdate):
+        db_task = self.get_task(task_id)
+        db_task.name = task.name
+        return db_task
+
+    def delete_task(self, task_id, _):
+        task = self.get_task(task_id)
+        if task.activity.finalized == True:
+            raise HTTPException(
+                status_code=400, detail="You can't delete a task with finalized activity")
+        self.db.query(TimeEntry).filter(TimeEntry.task_id == task_id).delete(
+            synchronize_session=False)
+        self.db.query(DailyRollup).filter(DailyRollup.task_id == task_id).delete(
+            synchronize_session=False)
+        self.db.delete(task)
+        self.touch(task.activity_id)
+
+    def create_time_entry(self, _, time_entry: TimeEntryCreate):
+        task = self.get_task(time_entry.task_id)
+        if task.activity.finalized == True:
+            raise HTTPException(
+                status_code=400, detail="You can't add time to a task with finalized activity")
+        if time_entry.end_time < time_entry.start_time:
+            raise HTTPException(
+                status_code=400, detail="end_time is before start_time")
+        new_time_entry = TimeEntry(
+            task_id=task.task_id,
+            start_time=time_entry.start_time,
+            end_time=time_entry.end_time,
+            duration=(time_entry.end_time - time_entry.start_time).total_seconds()
+        )
+        self.db.add(new_time_entry)
+        if task.start_time is None or task.start_time > time_entry.start_time:
+            task.start_time = time_entry.start_time
+        self.touch(task.activity_id, task.task_id)
+        return new_time_entry
+
+    def delete_time_entry(self, time_entry_id, _):
+        time_entry = self.db.query(TimeEntry).options(
+            joinedload(TimeEntry.task).joinedload(Task.activity)).get(time_entry_id)
+        if not time_entry:
+            raise HTTPException(status_code=404, detail="Time Entry not found")
+        task = time_entry.task
+        if task.activity.finalized == True:
+            raise HTTPException(
+                status_code=400, detail="You can't delete time from a task with finalized activity")
+        self.db.delete(time_entry)
+        self.touch(task.activity_id, task.task_id)
+
+    OPERATIONS = {
+        ("activity", "create"): (ActivityCreate, create_activity, 201),
+        ("activity", "update"): (ActivityUpdate, update_activity, 200),
+        ("activity", "delete"): (None, delete_activity, 200),
+        ("task", "create"): (TaskCreate, create_task, 201),
+        ("task", "update"): (TaskUpdate, update_task, 200),
+        ("task", "delete"): (None, delete_task, 200),
+        ("time_entry", "create"): (TimeEntryCreate, create_time_entry, 201),
+        ("time_entry", "delete"): (None, delete_time_entry, 200),
+    }
+
+    def apply(self, operation: BatchOperation):
+        """
+        Run one operation and return (status_code, row or None).
+        """
+        key = (operation.resource.value, operation.op.value)
+        if key not in self.OPERATIONS:
+            raise HTTPException(status_code=400, detail="Unsupported operation")
+        model, method, status_code = self.OPERATIONS[key]
+
+        if operation.op != BatchOp.create and operation.id is None:
+            raise HTTPException(status_code=400, detail="id is required")
+        payload = None
+        if model is not None:
+            try:
+                payload = model(**(operation.data or {}))
+            except ValidationError as error:
+                raise HTTPException(status_code=422, detail=error.errors())
+
+        row = method(self, operation.id, payload)
+        # Assign ids to new rows so later operations can refer to them.
+        self.db.flush()
+        return status_code, row
+
+    def update_rollups(self):
+        task_ids = set().union(*self.changes.values())
+        if task_ids:
+            rebuild_daily_rollups(self.db, list(task_ids))
+        if self.changes:
+            reconcile(self.db, list(self.changes))
+
+
+def run_batch(db, operations, schedule=None):
+    """
+    Apply operations in order in a single transaction.
+
+    Returns one BatchResult per operation. If an operation fails, nothing is
+    committed and an HTTPException is raised whose detail gives the index of
+    the failing operation and the reason.
+
+    Totals and rollups are recomputed in the same transaction, unless
+    schedule is given: it is then called after the commit with a dict of the
+    changed activity ids and their changed task ids, to recompute them
+    later.
+    """
+    batch = Batch(db)
+    rows = []
+    for index, operation in enumerate(operations):
+        try:
+            rows.append(batch.apply(operation))
+        except HTTPException as error:
+            db.rollback()
+            raise HTTPException(status_code=error.status_code,
+                                detail={"index": index, "detail": error.detail})
+
+    if schedule is None:
+        batch.update_rollups()
+    db.commit()
+    if schedule is not None and batch.changes:
+        schedule(batch.changes)
+
+    return [
+        BatchResult(status_code=status_code,
+                    data=row.to_response_model().dict() if row is not None else None)
+        for status_code, row in rows
+    ]
@@ -0,0 +1,381 @@
+"""
+Run scripted workloads against the API and report p50/p99 latency and
+throughput, optionally compared with a stored baseline.
+
+Workloads:
+    churn    start and stop time entries on open tasks
+    reads    activity, task and time entry lists and single rows
+    reports  reports by day, week and month
+
+The API is driven either in-process through the ASGI app or over HTTP
+through a local uvicorn process. Datasets are generated from a seed and kept
+in benchmarks/data, so runs are comparable; each run works on a copy.
+
+    python benchmarks/bench_api.py --scale small --target asgi
+    python benchmarks/bench_api.py --scale large --target uvicorn --concurrency 8
+    python benchmarks/bench_api.py --save-baseline benchmarks/baseline.json
+    python benchmarks/bench_api.py --baseline benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import select
+
+from database import Activity, Task, create_db_engine
+from generator import generate
+from migrations import migrate
+from settings import Settings
+
+DATA_DIRECTORY = os.path.join(ROOT, "benchmarks", "data")
+
+# activities, tasks, time entries
+SCALES = {
+    "small": (100, 1000, 10000),
+    "medium": (1000, 10000, 1000000),
+    "large": (1000, 100000, 10000000),
+}
+
+WORKLOADS = ["churn", "reads", "reports"]
+
+
+def get_dataset(scale, seed_value):
+    """
+    Path of the dataset for a scale and seed, generated on first use.
+    Datasets generated by an older version are migrated to the current
+    schema.
+    """
+    os.makedirs(DATA_DIRECTORY, exist_ok=True)
+    path = os.path.join(DATA_DIRECTORY, "{}-{}.db".format(scale, seed_value))
+    if os.path.exists(path):
+        engine = create_db_engine(Settings(database_url="sqlite:///{}".format(path),
+                                           sqlite_profile="production"))
+        migrate(engine)
+        engine.dispose()
+    else:
+        print("generating {} dataset {}".format(scale, path))
+        started = time.perf_counter()
+        engine = create_db_engine(Settings(database_url="sqlite:///{}".format(path + ".tmp"),
+                                           sqlite_profile="production"))
+        migrate(engine)
+        activities, tasks, entries = SCALES[scale]
+        with engine.begin() as connection:
+            # No running entries, so every open task can be started.
+            generate(connection, activities, tasks, entries, seed=seed_value,
+                     open_fraction=0, finalized_fraction=0.1)
+        engine.dispose()
+        os.replace(path + ".tmp", path)
+        print("generated in {:.1f} s".format(time.perf_counter() - started))
+    return path
+
+
+class AsgiClient:
+    """
+    Call the ASGI app directly, without a server or a network.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method, path, body=None):
+        path, _, query = path.partition("?")
+        content = json.dumps(body).encode() if body is not None else b""
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+            "query_string": query.encode(), "root_path": "",
+            "headers": [(b"host", b"bench"), (b"content-type", b"application/json"),
+                        (b"content-length", str(len(content)).encode())],
+            "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+        }
+        messages = [{"type": "http.request", "body": content, "more_body": False}]
+        disconnected = asyncio.Event()
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        response = {"status": None, "body": []}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            else:
+                response["body"].append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        disconnected.set()
+        return response["status"], b"".join(response["body"])
+
+    async def close(self):
+        await self.app.router.shutdown()
+
+
+class HttpClient:
+    """
+    Call a server over HTTP with one keep-alive connection per thread.
+    """
+
+    def __init__(self, port, concurrency):
+        self.port = port
+        self.local = threading.local()
+        self.loop = asyncio.get_running_loop()
+        self.executor = ThreadPoolExecutor(concurrency)
+
+    def send(self, method, path, body):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        content = json.dumps(body) if body is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        connection.request(method, path, body=content, headers=headers)
+        response = connection.getresponse()
+        return response.status, response.read()
+
+    async def request(self, method, path, body=None):
+        return await self.loop.run_in_executor(self.executor, self.send, method, path, body)
+
+    async def close(self):
+        self.executor.shutdown()
+
+
+def get_free_port():
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+
+
+def start_uvicorn(database_url, cache_size):
+    port = get_free_port()
+    env = dict(os.environ, TIME_TRACKER_DATABASE_URL=database_url,
+               TIME_TRACKER_SQLITE_PROFILE="production",
+               TIME_TRACKER_CACHE_SIZE=str(cache_size),
+               TIME_TRACKER_LOG_LEVEL="WARNING")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return process, port
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("uvicorn did not start")
+
+
+class Workloads:
+    """
+    Scripted steps, each picking its rows with the run's random generator
+    and told which of the concurrency workers runs it. Latencies are
+    recorded per request.
+    """
+
+    def __init__(self, client, activity_ids, open_task_ids, task_ids, generator,
+                 concurrency=1):
+        self.client = client
+        self.activity_ids = activity_ids
+        self.open_task_ids = open_task_ids
+        self.task_ids = task_ids
+        self.generator = generator
+        self.concurrency = concurrency
+        self.timings = []
+        self.errors = 0
+
+    async def call(self, method, path, body=None):
+        started = time.perf_counter()
+        status, content = await self.client.request(method, path, body)
+        self.timings.append(time.perf_counter() - started)
+        if status >= 400:
+            self.errors += 1
+        return status, content
+
+    async def churn(self, worker):
+        # Each worker starts its own tasks: two starts of the same task would
+        # get a 409 and count as an error.
+        task_id = self.generator.choice(self.open_task_ids[worker::self.concurrency])
+        status, content = await self.call("POST", "/api/time_entries/{}/start".format(task_id))
+        if status == 200:
+            time_entry_id = json.loads(content)["time_entry_id"]
+            await self.call("PUT", "/api/time_entries/{}/stop".format(time_entry_id))
+
+    async def reads(self, worker):
+        choice = self.generator.random()
+        activity_id = self.generator.choice(self.activity_ids)
+        if choice < 0.2:
+            await self.call("GET", "/api/activities/?limit=100")
+        elif choice < 0.4:
+            await self.call("GET", "/api/activities/{}/".format(activity_id))
+        elif choice < 0.7:
+            await self.call("GET", "/api/tasks/activity/{}/?limit=100".format(activity_id))
+        else:
+            task_id = self.generator.choice(self.task_ids)
+            await self.call("GET", "/api/time_entries/task/{}/?limit=100".format(task_id))
+
+    async def reports(self, worker):
+        choice = self.generator.random()
+        activity_id = self.generator.choice(self.activity_ids)
+        if choice < 0.4:
+            await self.call("GET", "/api/reports?bucket=month&activity_id={}".format(activity_id))
+        elif choice < 0.8:
+            await self.call("GET", "/api/reports?bucket=week&activity_id={}&start=2021-01-01"
+                                   "&end=2021-12-31".format(activity_id))
+        else:
+            await self.call("GET", "/api/reports?bucket=day&start=2021-06-01&end=2021-06-30")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+async def run_workload(name, client, ids, steps, concurrency, seed_value):
+    workloads = Workloads(client, *ids, random.Random(seed_value), concurrency)
+    step = getattr(workloads, name)
+    remaining = iter(range(steps))
+
+    async def worker(index):
+        for _ in remaining:
+            await step(index)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(index) for index in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(workloads.timings),
+        "errors": workloads.errors,
+        "throughput": round(len(workloads.timings) / elapsed, 1),
+        "p50_ms": round(percentile(workloads.timings, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(workloads.timings, 0.99) * 1000, 2),
+    }
+
+
+def load_ids(database_url):
+    engine = create_db_engine(Settings(database_url=database_url))
+    with engine.connect() as connection:
+        activity_ids = list(connection.execute(select(Activity.activity_id)).scalars())
+        task_ids = list(connection.execute(select(Task.task_id)).scalars())
+        open_task_ids = list(connection.execute(
+            select(Task.task_id).join(Activity, Activity.activity_id == Task.activity_id)
+            .where(Task.closed != True, Activity.finalized != True)).scalars())
+    engine.dispose()
+    return activity_ids, open_task_ids, task_ids
+
+
+async def run(args, database_url):
+    ids = load_ids(database_url)
+    process = None
+    if args.target == "asgi":
+        from main import create_app
+        app = create_app(Settings(database_url=database_url, sqlite_profile="production",
+                                  cache_size=args.cache_size, log_level="WARNING"))
+        await app.router.startup()
+        client = AsgiClient(app)
+    else:
+        process, port = start_uvicorn(database_url, args.cache_size)
+        client = HttpClient(port, args.concurrency)
+
+    results = {}
+    try:
+        for index, name in enumerate(args.workload or WORKLOADS):
+            results[name] = await run_workload(
+                name, client, ids, args.steps, args.concurrency, args.seed + index)
+    finally:
+        await client.close()
+        if process is not None:
+            process.terminate()
+            process.wait()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the change from the baseline; return the names of the workloads
+    whose p99 or throughput got worse by more than tolerance.
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+        p99 = result["p99_ms"] / previous["p99_ms"] - 1
+        throughput = result["throughput"] / previous["throughput"] - 1
+        print("{:<8} p99 {:+7.1%}   throughput {:+7.1%}".format(name, p99, throughput))
+        if p99 > tolerance or throughput < -tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--target", choices=["asgi", "uvicorn"], default="asgi")
+    parser.add_argument("--workload", choices=WORKLOADS, action="append",
+                        help="repeatable, default all")
+    parser.add_argument("--steps", type=int, default=2000, help="steps per workload")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--cache-size", type=int, default=1024, help="0 disables the read cache")
+    parser.add_argument("--baseline", help="compare with this results file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed p99 or throughput regression, default 25%%; "
+                             "runs on an idle machine vary by about 15%%")
+    parser.add_argument("--save-baseline", help="write the results to this file")
+    args = parser.parse_args()
+
+    dataset = get_dataset(args.scale, args.seed)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "bench.db")
+    shutil.copyfile(dataset, path)
+    database_url = "sqlite:///{}".format(path)
+
+    try:
+        results = asyncio.run(run(args, database_url))
+    finally:
+        shutil.rmtree(directory)
+
+    print("{:<8} {:>9} {:>7} {:>10} {:>9} {:>9}".format(
+        "workload", "requests", "errors", "req/s", "p50 ms", "p99 ms"))
+    for name, result in results.items():
+        print("{:<8} {requests:>9} {errors:>7} {throughput:>10.1f} {p50_ms:>9.2f} {p99_ms:>9.2f}"
+              .format(name, **result))
+
+    run_info = {"scale": args.scale, "seed": args.seed, "target": args.target,
+                "steps": args.steps, "concurrency": args.concurrency,
+                "cache_size": args.cache_size, "python": platform.python_version(),
+                "machine": platform.machine()}
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump({"run": run_info, "results": results}, file, indent=2)
+            file.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline["run"] != run_info:
+            print("warning: baseline was recorded with {}".format(baseline["run"]))
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("regressions: {}".format(", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Measure bulk import throughput of time entries into a fresh database.
+
+The target is at least 100k entries per second, rollup recomputation
+included:
+
+    python benchmarks/bench_import.py --entries 100000 --tasks 100 --format csv
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import sessionmaker
+
+from bulk import FORMATS, import_time_entries
+from database import Activity, Task, create_db_engine
+from migrations import migrate
+from settings import Settings
+
+
+def build_file(entries, tasks, format):
+    started = datetime(2020, 1, 1, 9, 0)
+    lines = ["task_id,start_time,end_time"] if format == "csv" else []
+    for i in range(entries):
+        start_time = started + timedelta(minutes=45 * i)
+        end_time = start_time + timedelta(minutes=30)
+        task_id = i % tasks + 1
+        if format == "csv":
+            lines.append("{},{},{}".format(task_id, start_time.isoformat(), end_time.isoformat()))
+        else:
+            lines.append(json.dumps({"task_id": task_id, "start_time": start_time.isoformat(),
+                                     "end_time": end_time.isoformat()}))
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--tasks", type=int, default=100)
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--profile", default="production")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    settings = Settings(database_url="sqlite:///{}".format(os.path.join(directory, "bench.db")),
+                        sqlite_profile=args.profile)
+    engine = create_db_engine(settings)
+    migrate(engine)
+    with engine.begin() as connection:
+        connection.execute(Activity.__table__.insert(), [{
+            "activity_id": 1, "name": "Import", "original_estimate": 1000.0,
+            "remaining_hours": 1000.0, "completed_hours": 0.0, "finalized": False,
+        }])
+        connection.execute(Task.__table__.insert(), [
+            {"task_id": i + 1, "activity_id": 1, "name": "Task {}".format(i), "duration": 0.0}
+            for i in range(args.tasks)
+        ])
+
+    content = build_file(args.entries, args.tasks, args.format)
+    db = sessionmaker(bind=engine)()
+
+    started = time.perf_counter()
+    result = import_time_entries(db, io.StringIO(content), args.format)
+    elapsed = time.perf_counter() - started
+    db.close()
+    engine.dispose()
+
+    print("imported {} entries in {:.2f} s: {:.0f} entries/s".format(
+        result.imported, elapsed, result.imported / elapsed))
+
+
+if __name__ == "__main__":
+    main()
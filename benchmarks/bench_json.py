@@ -0,0 +1,76 @@
+"""
+Compare list endpoint latency with the Pydantic response models and with the
+orjson fast path (settings.fast_json), on a task with many time entries:
+
+    python benchmarks/bench_json.py --entries 10000 --runs 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+from database import Activity, Task, TimeEntry, create_db_engine
+from main import create_app
+from migrations import migrate
+from settings import Settings
+
+
+def seed(engine, entries):
+    started = datetime(2020, 1, 1, 9, 0)
+    with engine.begin() as connection:
+        connection.execute(Activity.__table__.insert(), [{
+            "activity_id": 1, "name": "Benchmark", "original_estimate": 100.0,
+            "remaining_hours": 100.0, "completed_hours": 0.0, "finalized": False,
+        }])
+        connection.execute(Task.__table__.insert(), [{
+            "task_id": 1, "activity_id": 1, "name": "Benchmark task", "duration": 0.0,
+        }])
+        connection.execute(TimeEntry.__table__.insert(), [{
+            "task_id": 1,
+            "start_time": started + timedelta(hours=i),
+            "end_time": started + timedelta(hours=i, minutes=30),
+            "duration": 1800.0,
+        } for i in range(entries)])
+
+
+def measure(client, url, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    settings = Settings(database_url="sqlite:///{}".format(
+        os.path.join(directory, "bench.db")))
+    engine = create_db_engine(settings)
+    migrate(engine)
+    seed(engine, args.entries)
+    engine.dispose()
+
+    app = create_app(settings)
+    with TestClient(app) as client:
+        for fast_json in (False, True):
+            app.state.settings.fast_json = fast_json
+            median = measure(client, "/api/time_entries/task/1/", args.runs)
+            print("fast_json={:<6} median {:>8.1f} ms".format(str(fast_json), median))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Compare requests per second of the charset middleware implemented with
+BaseHTTPMiddleware and as a plain ASGI middleware.
+
+Requests are sent straight to the ASGI application, without a server or
+test client, so the numbers mostly reflect middleware overhead:
+
+    python benchmarks/bench_middleware.py --requests 20000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from main import UTF8ResponseMiddleware
+
+
+class BaseHTTPUTF8ResponseMiddleware(BaseHTTPMiddleware):
+    # The previous implementation, kept here for comparison.
+    async def dispatch(self, request, call_next):
+        response = await call_next(request)
+        if "Content-Type" in response.headers:
+            if "application/json" in response.headers["Content-Type"]:
+                response.headers["Content-Type"] = "application/json; charset=utf-8"
+        return response
+
+
+def build_app(middleware):
+    app = FastAPI()
+    if middleware is not None:
+        app.add_middleware(middleware)
+
+    @app.get("/api/ping")
+    async def ping():
+        return {"name": "Atividade", "completed_hours": 1.5}
+
+    return app
+
+
+async def run(app, requests):
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/api/ping",
+        "raw_path": b"/api/ping",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("localhost", 80),
+    }
+
+    async def send(message):
+        pass
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # Like a server: once the body is read, wait for a disconnect.
+            await asyncio.sleep(3600)
+            return {"type": "http.disconnect"}
+
+        await app(dict(scope), receive, send)
+    return requests / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    variants = [
+        ("none", None),
+        ("BaseHTTPMiddleware", BaseHTTPUTF8ResponseMiddleware),
+        ("ASGI", UTF8ResponseMiddleware),
+    ]
+    for name, middleware in variants:
+        throughput = asyncio.run(run(build_app(middleware), args.requests))
+        print("{:<20} {:>10.0f} req/s".format(name, throughput))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Compare activity name lookups with LIKE '%name%' (list_activities) and with
+the FTS5 prefix search (/api/search) on a large table:
+
+    python benchmarks/bench_search.py --rows 1000000 --runs 20
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import sessionmaker
+
+from database import Activity, create_db_engine
+from migrations import migrate
+from models import SearchType
+from search import search_names
+from settings import Settings
+
+WORDS = [
+    "alpha", "backend", "billing", "client", "dashboard", "design", "export",
+    "frontend", "invoice", "login", "mobile", "onboarding", "payment", "portal",
+    "report", "review", "search", "settings", "support", "website",
+]
+
+
+def seed(engine, rows, batch_size=50000):
+    generator = random.Random(0)
+    with engine.begin() as connection:
+        for start in range(0, rows, batch_size):
+            connection.execute(Activity.__table__.insert(), [{
+                "name": "{} {} {}".format(generator.choice(WORDS), generator.choice(WORDS), i),
+                "original_estimate": 1.0, "remaining_hours": 1.0,
+                "completed_hours": 0.0, "finalized": False,
+            } for i in range(start, min(start + batch_size, rows))])
+
+
+def measure(function, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--query", action="append",
+                        help="search text, repeatable (default: a rare, a common and a short one)")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    settings = Settings(database_url="sqlite:///{}".format(os.path.join(directory, "bench.db")),
+                        sqlite_profile="production")
+    engine = create_db_engine(settings)
+    migrate(engine)
+    started = time.perf_counter()
+    seed(engine, args.rows)
+    print("seeded {} activities in {:.1f} s".format(args.rows, time.perf_counter() - started))
+
+    db = sessionmaker(bind=engine)()
+    for query in args.query or ["987654", "invoice 4242", "desi"]:
+        # list_activities filters on the whole text and returns every match.
+        like = lambda: db.query(Activity).filter(Activity.name.contains(query)).all()
+        fts = lambda: search_names(db, query, args.limit, SearchType.activity)
+        print("{!r:<16} LIKE median {:>9.2f} ms   FTS5 median {:>9.2f} ms".format(
+            query, measure(like, args.runs), measure(fts, args.runs)))
+    db.close()
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
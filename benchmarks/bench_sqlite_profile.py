@@ -0,0 +1,97 @@
+"""
+Compare concurrent start/stop throughput with and without the SQLite
+production profile.
+
+Each thread starts and stops time entries on its own task through the API,
+against a fresh database file per profile:
+
+    python benchmarks/bench_sqlite_profile.py --threads 8 --cycles 100
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+from database import Activity, Base, Task, create_db_engine
+from main import app, get_db
+from settings import Settings
+
+
+def run_profile(profile, threads, cycles):
+    directory = tempfile.mkdtemp()
+    settings = Settings(
+        database_url="sqlite:///{}".format(os.path.join(directory, "bench.db")),
+        sqlite_profile=profile,
+        pool_size=threads
+    )
+    engine = create_db_engine(settings)
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = SessionLocal()
+    activity = Activity(name="Benchmark", original_estimate=100.0,
+                        remaining_hours=100.0, completed_hours=0.0, finalized=False)
+    db.add(activity)
+    db.flush()
+    tasks = [Task(activity_id=activity.activity_id, name="Task {}".format(i), duration=0.0)
+             for i in range(threads)]
+    db.add_all(tasks)
+    db.commit()
+    task_ids = [task.task_id for task in tasks]
+    db.close()
+
+    def override_get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    client = TestClient(app)
+
+    def churn(task_id):
+        errors = 0
+        for _ in range(cycles):
+            response = client.post("/api/time_entries/{}/start".format(task_id))
+            if response.status_code != 200:
+                errors += 1
+                continue
+            time_entry_id = response.json()["time_entry_id"]
+            response = client.put("/api/time_entries/{}/stop".format(time_entry_id))
+            if response.status_code != 200:
+                errors += 1
+        return errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        errors = sum(executor.map(churn, task_ids))
+    elapsed = time.perf_counter() - started
+
+    app.dependency_overrides.pop(get_db)
+    engine.dispose()
+
+    requests = threads * cycles * 2
+    return requests / elapsed, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--cycles", type=int, default=100)
+    args = parser.parse_args()
+
+    for profile in ("default", "production"):
+        throughput, errors = run_profile(profile, args.threads, args.cycles)
+        print("{:<12} {:>10.1f} req/s  {} errors".format(profile, throughput, errors))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Measure cold start: the time to import main and the latency of the first
+request, including application startup.
+
+Every run happens in a fresh interpreter against a migrated temporary
+database:
+
+    python benchmarks/bench_startup.py --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    client.get("/api/activities/")
+    first_request = time.perf_counter()
+print(json.dumps({"import": imported - started, "first_request": first_request - imported}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env["TIME_TRACKER_DATABASE_URL"] = "sqlite:///{}".format(
+        os.path.join(directory, "bench.db"))
+    subprocess.run([sys.executable, "manage.py", "migrate"],
+                   cwd=ROOT, env=env, check=True, capture_output=True)
+
+    timings = {"import": [], "first_request": []}
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env,
+                                check=True, capture_output=True, text=True).stdout
+        for name, value in json.loads(output.splitlines()[-1]).items():
+            timings[name].append(value * 1000)
+
+    for name, values in timings.items():
+        print("{:<14} median {:>8.1f} ms  min {:>8.1f} ms".format(
+            name, statistics.median(values), min(values)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import csv
+import json
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import func, select, update
+
+from database import Activity, Task, TimeEntry
+from models import ImportResult, ImportRowError
+from rollups import reconcile, split_by_day, upsert_daily_rollups
+
+# Bulk import and export of time entries, as CSV or newline-delimited JSON.
+# Rows have the fields of models.TimeEntryCreate: task_id, start_time and
+# end_time, with ISO 8601 datetimes. Exports write the same fields, so an
+# export can be imported again.
+
+FIELDS = ["task_id", "start_time", "end_time"]
+FORMATS = ["csv", "ndjson"]
+
+# Errors kept in the import result; the rest are only counted.
+MAX_ERRORS = 100
+
+
+def read_rows(stream, format):
+    """
+    Yield (line_number, row) from a text stream, row being a dict or, for
+    malformed NDJSON, the exception raised while decoding it.
+    """
+    if format == "csv":
+        reader = csv.reader(stream)
+        header = next(reader, None)
+        for values in reader:
+            if values:
+                yield reader.line_num, dict(zip(header, values))
+    elif format == "ndjson":
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as error:
+                yield line_number, error
+    else:
+        raise ValueError("Unknown format: {}".format(format))
+
+
+def parse_datetime(value):
+    if isinstance(value, str) and value.endswith("Z"):
+        value = value[:-1]
+    return datetime.fromisoformat(value)
+
+
+def parse_time_entry(row):
+    """
+    Validate one row against the TimeEntryCreate fields.
+
+    Checked by hand instead of through the Pydantic model, which would be the
+    bottleneck of an import. Raises ValueError with a readable message.
+    """
+    if isinstance(row, Exception):
+        raise ValueError("Invalid JSON: {}".format(row))
+    if not isinstance(row, dict):
+        raise ValueError("Expected an object")
+    try:
+        task_id = int(row["task_id"])
+        start_time = parse_datetime(row["start_time"])
+        end_time = parse_datetime(row["end_time"])
+    except KeyError as error:
+        raise ValueError("Missing field {}".format(error))
+    except (TypeError, ValueError) as error:
+        raise ValueError(str(error))
+    if start_time.tzinfo is not None or end_time.tzinfo is not None:
+        raise ValueError("Datetimes must not have a time zone")
+    if end_time < start_time:
+        raise ValueError("end_time is before start_time")
+    return task_id, start_time, end_time
+
+
+def insert_time_entries(db, entries):
+    """
+    Insert (task_id, start_time, end_time) tuples with one executemany.
+
+    On SQLite the datetimes are formatted the way SQLAlchemy stores them and
+    sent straight to the driver, skipping the per-value type processing.
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        db.connection().exec_driver_sql(
+            "INSERT INTO time_entries (task_id, start_time, end_time, duration) "
+            "VALUES (?, ?, ?, ?)",
+            [(task_id, start_time.isoformat(" ", "microseconds"),
+              end_time.isoformat(" ", "microseconds"),
+              (end_time - start_time).total_seconds())
+             for task_id, start_time, end_time in entries]
+        )
+    else:
+        db.execute(TimeEntry.__table__.insert(), [
+            {"task_id": task_id, "start_time": start_time, "end_time": end_time,
+             "duration": (end_time - start_time).total_seconds()}
+            for task_id, start_time, end_time in entries
+        ])
+
+
+def update_rollups(db, daily_seconds, recompute=True):
+    """
+    Bring task start times, durations, activity hours and daily rollups up to
+    date after an import.
+
+    daily_seconds maps (task_id, date) to the seconds imported for that day;
+    they are added to the existing daily rollups. Durations and hours are
+    only recomputed if recompute is set. Returns the affected activity ids.
+    """
+    task_ids = list({task_id for task_id, _ in daily_seconds})
+    if not task_ids:
+        return set()
+
+    first_start = select(func.min(TimeEntry.start_time)).where(
+        TimeEntry.task_id == Task.task_id).scalar_subquery()
+    db.execute(
+        update(Task)
+        .where(Task.task_id.in_(task_ids), Task.start_time == None)
+        .values(start_time=first_start, version=Task.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+    activity_ids = dict(db.execute(
+        select(Task.task_id, Task.activity_id).where(Task.task_id.in_(task_ids))).all())
+    if recompute:
+        reconcile(db, list(set(activity_ids.values())))
+    upsert_daily_rollups(db, [
+        {"task_id": task_id, "activity_id": activity_ids[task_id],
+         "date": date, "seconds": seconds}
+        for (task_id, date), seconds in daily_seconds.items()
+    ])
+    return set(activity_ids.values())
+
+
+def add_error(result, line_number, message):
+    result.skipped += 1
+    if len(result.errors) < MAX_ERRORS:
+        result.errors.append(ImportRowError(line=line_number, message=message))
+
+
+def import_time_entries(db, stream, format, batch_size=10000, schedule=None):
+    """
+    Import time entries from a text stream.
+
+    Rows are validated and inserted in batches, each committed on its own.
+    Invalid rows and rows for unknown tasks or tasks of finalized activities
+    are skipped and reported. If the stream cannot be decoded the import
+    stops there, and result.line is the last line of the batches already
+    committed. The rollups of the affected tasks are recomputed at the end,
+    also when the import stops or fails; if schedule is given, task
+    durations and activity hours are left to it instead, called after the
+    commit with the affected activity ids.
+    """
+    result = ImportResult()
+    daily_seconds = {}
+    rows = read_rows(stream, format)
+
+    # The rollups of the batches already committed are brought up to date
+    # even if a later batch fails.
+    try:
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                break
+
+            entries = []
+            for line_number, row in chunk:
+                try:
+                    entries.append((line_number, parse_time_entry(row)))
+                except ValueError as error:
+                    add_error(result, line_number, str(error))
+
+            task_ids = {entry[0] for _, entry in entries}
+            finalized = dict(db.execute(
+                select(Task.task_id, Activity.finalized)
+                .outerjoin(Activity, Activity.activity_id == Task.activity_id)
+                .where(Task.task_id.in_(list(task_ids)))).all())
+
+            valid = []
+            for line_number, entry in entries:
+                if entry[0] not in finalized:
+                    add_error(result, line_number,
+                              "Task {} not found".format(entry[0]))
+                elif finalized[entry[0]]:
+                    add_error(result, line_number,
+                              "You can't add time to a task with finalized activity")
+                else:
+                    valid.append(entry)
+
+            if valid:
+                insert_time_entries(db, valid)
+                db.commit()
+                result.imported += len(valid)
+
+                for task_id, start_time, end_time in valid:
+                    for date, seconds in split_by_day(start_time, end_time):
+                        key = (task_id, date)
+                        daily_seconds[key] = daily_seconds.get(key, 0) + seconds
+            result.line = chunk[-1][0]
+    except UnicodeDecodeError as error:
+        result.complete = False
+        result.errors.append(ImportRowError(
+            line=result.line + 1,
+            message="Stopped reading after line {}: {}".format(result.line, error)))
+    finally:
+        db.rollback()
+        activity_ids = update_rollups(db, daily_seconds, recompute=schedule is None)
+        db.commit()
+        if schedule is not None and activity_ids:
+            schedule({activity_id: set() for activity_id in activity_ids})
+    return result
+
+
+def export_time_entries(db, format, task_ids=None, activity_id=None, batch_size=1000):
+    """
+    Yield stopped time entries as CSV or NDJSON text, in chunks of
+    batch_size rows, streaming them from the database.
+    """
+    if format not in FORMATS:
+        raise ValueError("Unknown format: {}".format(format))
+
+    query = (
+        select(TimeEntry.task_id, TimeEntry.start_time, TimeEntry.end_time)
+        .where(TimeEntry.end_time != None)
+        .order_by(TimeEntry.time_entry_id)
+        .execution_options(stream_results=True)
+    )
+    if task_ids is not None:
+        query = query.where(TimeEntry.task_id.in_(task_ids))
+    if activity_id is not None:
+        query = query.join(Task, Task.task_id == TimeEntry.task_id).where(
+            Task.activity_id == activity_id)
+
+    if format == "csv":
+        yield ",".join(FIELDS) + "\n"
+
+    lines = []
+    for task_id, start_time, end_time in db.execute(query):
+        if format == "csv":
+            lines.append("{},{},{}\n".format(
+                task_id, start_time.isoformat(), end_time.isoformat()))
+        else:
+            lines.append(json.dumps({"task_id": task_id, "start_time": start_time.isoformat(),
+                                     "end_time": end_time.isoformat()}) + "\n")
+        if len(lines) == batch_size:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
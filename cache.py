@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Read cache for the get and list endpoints.
+#
+# Keys are tuples starting with the resource name, e.g.
+# ("activities", finalized, name, limit, after) or ("tasks", activity_id, ...).
+# Write handlers invalidate by key prefix, so a change to one activity's
+# tasks leaves the other activities' entries in place. Entries also expire
+# after a TTL, which bounds how stale a value can get when the database is
+# changed by something else (manage.py, another worker process).
+
+
+class ReadCache:
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Bumped by every invalidation, see set().
+        self.generation = 0
+
+    def get(self, key):
+        """
+        Return the cached value for key, or None.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, generation):
+        """
+        Store a value loaded while the cache was at generation.
+
+        The value is dropped if anything was invalidated since, as it may have
+        been read from the database before that write was committed.
+        """
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, *prefixes):
+        """
+        Drop every entry whose key starts with one of the prefixes.
+        """
+        with self.lock:
+            self.generation += 1
+            for key in list(self.entries):
+                if any(key[:len(prefix)] == prefix for prefix in prefixes):
+                    del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self.entries), "maxsize": self.maxsize}
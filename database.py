@@ -1,5 +1,6 @@
-from sqlalchemy import Boolean, create_engine, Column, Integer, String, Float, DateTime, ForeignKey
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy import DDL, Boolean, create_engine, event, text, Column, Integer, String, Float, Date, DateTime, ForeignKey, Index
+from sqlalchemy.orm import declarative_base, object_session, relationship
+from sqlalchemy.pool import QueuePool
 
 from models import ActivityResponse, TaskResponse, TimeEntryResponse
 
@@ -13,6 +14,13 @@ def get_formmated_datetime(date):
     return None
 
 
+def get_truncated_datetime(date):
+    # Same value as get_formmated_datetime, kept as a datetime.
+    if date is not None:
+        return date.replace(second=0, microsecond=0)
+    return None
+
+
 def get_round(value):
     if value is not None:
         return round(value, 2)
@@ -30,8 +38,12 @@ class Activity(Base):
     finalized = Column(Boolean)
     price_per_hour = Column(Float)
     money_received = Column(Boolean)
+    # Incremented on every change, see bump_version().
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
-    tasks = relationship("Task", back_populates="activity")
+    # Deletes don't load the collections; see delete_activity and
+    # delete_task in main.py.
+    tasks = relationship("Task", back_populates="activity", passive_deletes=True)
 
     def to_response_model(self) -> ActivityResponse:
         return ActivityResponse(
@@ -45,20 +57,33 @@ class Activity(Base):
             money_received=self.money_received
         )
 
+    def to_dict(self):
+        return {
+            "activity_id": self.activity_id,
+            "name": self.name,
+            "original_estimate": self.original_estimate,
+            "remaining_hours": get_round(self.remaining_hours),
+            "completed_hours": get_round(self.completed_hours),
+            "finalized": self.finalized,
+            "price_per_hour": self.price_per_hour,
+            "money_received": self.money_received
+        }
+
 
 class Task(Base):
     __tablename__ = "tasks"
 
     task_id = Column(Integer, primary_key=True)
-    activity_id = Column(Integer, ForeignKey("activities.activity_id"))
+    activity_id = Column(Integer, ForeignKey("activities.activity_id"), index=True)
     name = Column(String(255))
     start_time = Column(DateTime, nullable=True)
     end_time = Column(DateTime, nullable=True)
     duration = Column(Float)
     closed = Column(Boolean)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     activity = relationship(Activity)
-    time_entries = relationship("TimeEntry", back_populates="task")
+    time_entries = relationship("TimeEntry", back_populates="task", passive_deletes=True)
 
     def to_response_model(self) -> TaskResponse:
         return TaskResponse(
@@ -71,18 +96,42 @@ class Task(Base):
             closed=self.closed
         )
 
+    def to_dict(self):
+        return {
+            "task_id": self.task_id,
+            "activity_id": self.activity_id,
+            "name": self.name,
+            "start_time": get_truncated_datetime(self.start_time),
+            "end_time": get_truncated_datetime(self.end_time),
+            "duration": round(self.duration, 2),
+            "closed": self.closed
+        }
+
 
 class TimeEntry(Base):
     __tablename__ = "time_entries"
 
     time_entry_id = Column(Integer, primary_key=True)
-    task_id = Column(Integer, ForeignKey("tasks.task_id", ondelete="CASCADE"))
+    task_id = Column(Integer, ForeignKey("tasks.task_id", ondelete="CASCADE"), index=True)
     start_time = Column(DateTime)
     end_time = Column(DateTime, nullable=True)
     duration = Column(Float, nullable=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     task = relationship(Task)
 
+    __table_args__ = (
+        # Running entries only, for the /playing lookup. Unique, so a task
+        # has at most one running entry even with concurrent starts.
+        Index(
+            "ix_time_entries_running",
+            "task_id",
+            unique=True,
+            sqlite_where=text("end_time IS NULL"),
+            postgresql_where=text("end_time IS NULL")
+        ),
+    )
+
     def to_response_model(self) -> TimeEntryResponse:
         return TimeEntryResponse(
             time_entry_id=self.time_entry_id,
@@ -91,8 +140,118 @@ class TimeEntry(Base):
             end_time=self.end_time
         )
 
+    def to_dict(self):
+        return {
+            "time_entry_id": self.time_entry_id,
+            "task_id": self.task_id,
+            "start_time": self.start_time,
+            "end_time": self.end_time
+        }
+
+
+def get_search_ddl(table, key):
+    """
+    Statements creating the FTS5 index over the name column of table and the
+    triggers keeping it in sync. Only names are indexed, so the rollup
+    updates don't touch it. prefix='2 3' makes short prefix queries cheap.
+    """
+    index = "{}_fts".format(table)
+    insert = "INSERT INTO {index} (rowid, name) VALUES (new.{key}, new.name);"
+    delete = ("INSERT INTO {index} ({index}, rowid, name) "
+              "VALUES ('delete', old.{key}, old.name);")
+    statements = [
+        "CREATE VIRTUAL TABLE {index} USING fts5("
+        "name, content='{table}', content_rowid='{key}', prefix='2 3')",
+        "CREATE TRIGGER {index}_insert AFTER INSERT ON {table} BEGIN " + insert + " END",
+        "CREATE TRIGGER {index}_delete AFTER DELETE ON {table} BEGIN " + delete + " END",
+        "CREATE TRIGGER {index}_update AFTER UPDATE OF name ON {table} BEGIN "
+        + delete + " " + insert + " END",
+    ]
+    return [statement.format(index=index, table=table, key=key) for statement in statements]
+
+
+def bump_version(mapper, connection, target):
+    """
+    Increment the version of a row changed through the ORM, atomically in the
+    UPDATE statement. Core UPDATE statements set version themselves.
+    """
+    if object_session(target).is_modified(target, include_collections=False):
+        target.version = mapper.class_.version + 1
+
+
+for model in (Activity, Task, TimeEntry):
+    event.listen(model, "before_update", bump_version)
+
+for model, key in ((Activity, "activity_id"), (Task, "task_id")):
+    for statement in get_search_ddl(model.__tablename__, key):
+        event.listen(model.__table__, "after_create",
+                     DDL(statement).execute_if(dialect="sqlite"))
+
+
+class DailyRollup(Base):
+    """
+    Seconds tracked per task and day, kept up to date when time entries are
+    stopped. Entries that cross midnight are split between the days.
+    """
+    __tablename__ = "daily_rollups"
+
+    task_id = Column(Integer, ForeignKey("tasks.task_id", ondelete="CASCADE"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    activity_id = Column(Integer, ForeignKey("activities.activity_id"))
+    seconds = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_daily_rollups_activity_id_date", "activity_id", "date"),
+    )
+
+
+def get_sqlite_pragmas(settings):
+    """
+    PRAGMAs to run on each new SQLite connection for the configured profile.
+    """
+    if settings.sqlite_profile == "default":
+        return []
+    if settings.sqlite_profile == "production":
+        return [
+            ("journal_mode", "WAL"),
+            ("synchronous", "NORMAL"),
+            ("busy_timeout", settings.sqlite_busy_timeout),
+            ("cache_size", settings.sqlite_cache_size),
+            ("mmap_size", settings.sqlite_mmap_size)
+        ]
+    raise ValueError(
+        "Unknown SQLite profile: {}".format(settings.sqlite_profile))
+
+
+def create_db_engine(settings):
+    """
+    Create the engine with a bounded connection pool.
+
+    Request handlers run in the server's thread pool, so SQLite connections
+    have to be shareable between threads.
+    """
+    connect_args = {}
+    if settings.database_url.startswith("sqlite"):
+        connect_args["check_same_thread"] = False
+
+    engine = create_engine(
+        settings.database_url,
+        poolclass=QueuePool,
+        pool_size=settings.pool_size,
+        max_overflow=settings.max_overflow,
+        pool_timeout=settings.pool_timeout,
+        connect_args=connect_args
+    )
+
+    if engine.dialect.name == "sqlite":
+        pragmas = get_sqlite_pragmas(settings)
+
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas:
+                cursor.execute("PRAGMA {} = {}".format(name, value))
+            cursor.close()
+
+    return engine
 
-# Database setup
-engine = create_engine("sqlite:///time_tracker.db")
-Base.metadata.create_all(bind=engine)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+
+import orjson
+
+# In-process publish/subscribe for change events.
+#
+# Handlers run in the threadpool and publish from there; each subscriber is an
+# asyncio.Queue read by an event stream response on the event loop, so events
+# are handed over with call_soon_threadsafe. Events only reach clients of the
+# same process.
+
+# Events kept for a subscriber that does not keep up; older ones are dropped.
+MAX_PENDING_EVENTS = 100
+
+# Seconds between keepalive comments on an idle stream.
+KEEPALIVE_INTERVAL = 15
+
+
+class EventBroker:
+    def __init__(self, max_pending=MAX_PENDING_EVENTS):
+        self.max_pending = max_pending
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        """
+        Register a subscriber on the running event loop and return its queue.
+        """
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(self.max_pending))
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, type, data):
+        """
+        Send an event to every subscriber. Safe to call from any thread.
+        """
+        self._send({"type": type, "data": data})
+
+    def close(self):
+        """
+        End every subscriber's stream, so open connections don't hold up a
+        shutdown.
+        """
+        self._send(None)
+
+    def _send(self, event):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(put_event, queue, event)
+            except RuntimeError:
+                # The subscriber's loop is closed.
+                self.unsubscribe((loop, queue))
+
+
+def put_event(queue, event):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+def format_event(event):
+    """
+    Encode an event in the server-sent events format.
+    """
+    return b"event: " + event["type"].encode() + b"\ndata: " + orjson.dumps(event["data"]) + b"\n\n"
+
+
+async def stream_events(broker, subscriber, keepalive=KEEPALIVE_INTERVAL):
+    """
+    Yield server-sent events for a subscriber until the broker is closed or
+    the client disconnects.
+    """
+    _, queue = subscriber
+    try:
+        yield b"retry: 3000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if event is None:
+                break
+            yield format_event(event)
+    finally:
+        broker.unsubscribe(subscriber)
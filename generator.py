@@ -0,0 +1,228 @@
+import random
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import bindparam, func, select, update
+
+from database import Activity, DailyRollup, Task, TimeEntry
+from rollups import split_by_day
+
+# Synthetic datasets for profiling: activities, tasks, time entries and their
+# rollups, generated from a seed so the same arguments always produce the
+# same rows. Rows are written with executemany in batches, and on SQLite the
+# secondary indexes of the two big tables are rebuilt once at the end instead
+# of being maintained row by row.
+
+DISTRIBUTIONS = ["uniform", "skewed"]
+
+WORDS = [
+    "api", "backend", "billing", "client", "dashboard", "design", "export",
+    "frontend", "invoice", "login", "migration", "mobile", "onboarding",
+    "payment", "portal", "report", "review", "search", "settings", "support",
+]
+
+# Mean length of a time entry, in seconds.
+MEAN_DURATION = 45 * 60
+
+
+def get_counts(generator, total, parts, distribution):
+    """
+    Split total into parts counts: near equal, or heavy-tailed (Pareto) so a
+    few tasks hold most of the entries.
+    """
+    if parts == 0:
+        return []
+    if distribution == "uniform":
+        weights = [generator.uniform(0.5, 1.5) for _ in range(parts)]
+    elif distribution == "skewed":
+        weights = [generator.paretovariate(1.2) for _ in range(parts)]
+    else:
+        raise ValueError("Unknown distribution: {}".format(distribution))
+
+    scale = total / sum(weights)
+    counts = [int(weight * scale) for weight in weights]
+    for index in range(total - sum(counts)):
+        counts[index % parts] += 1
+    return counts
+
+
+def get_secondary_indexes(connection, tables):
+    rows = connection.exec_driver_sql(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+        "AND tbl_name IN ({})".format(", ".join("'{}'".format(table) for table in tables)))
+    return rows.all()
+
+
+def format_time(value):
+    """
+    A datetime as SQLite stores it, see bulk.insert_time_entries.
+    """
+    return value.isoformat(" ", "microseconds")
+
+
+def keep(value):
+    return value
+
+
+def insert_rows(connection, table, columns, rows):
+    """
+    Insert rows of values in columns order, already formatted for SQLite when
+    writing there.
+    """
+    if not rows:
+        return
+    if connection.dialect.name == "sqlite":
+        connection.exec_driver_sql(
+            "INSERT INTO {} ({}) VALUES ({})".format(
+                table.name, ", ".join(columns), ", ".join("?" * len(columns))),
+            rows)
+    else:
+        connection.execute(table.insert(), [dict(zip(columns, row)) for row in rows])
+
+
+def generate(connection, activities=100, tasks=1000, entries=100000, seed=0,
+             distribution="uniform", open_fraction=0.05, finalized_fraction=0.2,
+             years=3, end=datetime(2025, 1, 1), batch_size=100000):
+    """
+    Fill an empty, migrated database. Returns the number of rows written per
+    table.
+
+    Tasks are spread over activities and entries over tasks following
+    distribution. Each task's entries fall, without overlapping, in a window
+    between its start, somewhere in the years before end, and end. A
+    finalized_fraction of the activities are finalized, with their tasks
+    closed; open_fraction of the other tasks have a running entry started up
+    to two weeks before end. Task durations, activity hours and daily
+    rollups are filled in to match the entries. The caller commits.
+    """
+    generator = random.Random(seed)
+    span_start = end - timedelta(days=365 * years)
+    span = (end - span_start).total_seconds()
+
+    finalized = [generator.random() < finalized_fraction for _ in range(activities)]
+    activity_rows = [
+        (activity_id, "{} {} {}".format(generator.choice(WORDS).title(),
+                                        generator.choice(WORDS), activity_id),
+         finalized[activity_id - 1], generator.choice([40.0, 60.0, 80.0, 100.0, 120.0]),
+         finalized[activity_id - 1] and generator.random() < 0.5)
+        for activity_id in range(1, activities + 1)
+    ]
+    insert_rows(connection, Activity.__table__,
+                ["activity_id", "name", "finalized", "price_per_hour", "money_received",
+                 "original_estimate", "remaining_hours", "completed_hours"],
+                [row + (0.0, 0.0, 0.0) for row in activity_rows])
+
+    indexes = []
+    to_time = to_date = keep
+    if connection.dialect.name == "sqlite":
+        to_time, to_date = format_time, date.isoformat
+        indexes = get_secondary_indexes(connection, ["time_entries", "daily_rollups"])
+        for name, _ in indexes:
+            connection.exec_driver_sql("DROP INDEX {}".format(name))
+
+    task_activities = [
+        activity_id
+        for activity_id, count in enumerate(get_counts(generator, tasks, activities, distribution), 1)
+        for _ in range(count)
+    ]
+    entry_counts = get_counts(generator, entries, tasks, distribution)
+    activity_minutes = [0.0] * (activities + 1)
+
+    task_columns = ["task_id", "activity_id", "name", "start_time", "end_time",
+                    "duration", "closed"]
+    entry_columns = ["task_id", "start_time", "end_time", "duration"]
+    rollup_columns = ["task_id", "date", "activity_id", "seconds"]
+    task_rows, entry_rows, rollup_rows = [], [], []
+    written = {"activities": activities, "tasks": tasks, "time_entries": 0, "daily_rollups": 0}
+
+    def flush():
+        insert_rows(connection, Task.__table__, task_columns, task_rows)
+        insert_rows(connection, TimeEntry.__table__, entry_columns, entry_rows)
+        insert_rows(connection, DailyRollup.__table__, rollup_columns, rollup_rows)
+        written["time_entries"] += len(entry_rows)
+        written["daily_rollups"] += len(rollup_rows)
+        task_rows.clear()
+        entry_rows.clear()
+        rollup_rows.clear()
+
+    for task_index in range(tasks):
+        task_id = task_index + 1
+        activity_id = task_activities[task_index]
+        closed = finalized[activity_id - 1]
+        count = entry_counts[task_index]
+
+        window_start = generator.random() * span * 0.9
+        window_end = span if not closed else window_start + (span - window_start) * generator.uniform(0.2, 1)
+        slot = (window_end - window_start) / max(count, 1)
+
+        seconds_total = 0.0
+        days = {}
+        first_start = last_end = None
+        for index in range(count):
+            offset = window_start + index * slot + generator.random() * slot * 0.3
+            duration = min(generator.expovariate(1 / MEAN_DURATION) + 300, slot * 0.6)
+            start_time = span_start + timedelta(seconds=offset)
+            end_time = start_time + timedelta(seconds=duration)
+            duration = (end_time - start_time).total_seconds()
+            entry_rows.append((task_id, to_time(start_time), to_time(end_time), duration))
+            seconds_total += duration
+            if first_start is None:
+                first_start = start_time
+            last_end = end_time
+
+            day = start_time.date()
+            if day == end_time.date():
+                days[day] = days.get(day, 0) + duration
+            else:
+                for day, seconds in split_by_day(start_time, end_time):
+                    days[day] = days.get(day, 0) + seconds
+
+        if not closed and generator.random() < open_fraction:
+            start_time = end - timedelta(seconds=generator.uniform(3600, 14 * 24 * 3600))
+            if last_end is not None and start_time < last_end:
+                start_time = last_end + timedelta(minutes=1)
+            entry_rows.append((task_id, to_time(start_time), None, None))
+            first_start = first_start or start_time
+
+        minutes = seconds_total / 60
+        activity_minutes[activity_id] += minutes
+        task_rows.append((task_id, activity_id,
+                          "{} {} {}".format(generator.choice(WORDS).title(),
+                                            generator.choice(WORDS), task_id),
+                          first_start and to_time(first_start),
+                          to_time(last_end) if closed and last_end else None, minutes, closed))
+        rollup_rows.extend((task_id, to_date(day), activity_id, seconds)
+                           for day, seconds in days.items())
+
+        if len(entry_rows) >= batch_size:
+            flush()
+    flush()
+
+    for name, sql in indexes:
+        connection.exec_driver_sql(sql)
+    if connection.dialect.name == "postgresql":
+        # Activities and tasks were inserted with their keys, which leaves
+        # the sequences behind.
+        for table, key in [("activities", "activity_id"), ("tasks", "task_id")]:
+            connection.exec_driver_sql(
+                "SELECT setval(pg_get_serial_sequence('{0}', '{1}'), "
+                "coalesce(max({1}), 0) + 1, false) FROM {0}".format(table, key))
+
+    completed_hours = [minutes / 60 for minutes in activity_minutes]
+    statement = (
+        update(Activity)
+        .where(Activity.activity_id == bindparam("id"))
+        .values(completed_hours=bindparam("completed"), original_estimate=bindparam("estimate"),
+                remaining_hours=bindparam("remaining"))
+    )
+    estimates = [round(hours * generator.uniform(0.8, 1.5) + 1) for hours in completed_hours]
+    connection.execute(statement, [
+        {"id": activity_id, "completed": completed_hours[activity_id],
+         "estimate": float(estimates[activity_id]),
+         "remaining": estimates[activity_id] - completed_hours[activity_id]}
+        for activity_id in range(1, activities + 1)
+    ])
+    return written
+
+
+def is_empty(connection):
+    return connection.execute(select(func.count()).select_from(Activity.__table__)).scalar() == 0
@@ -0,0 +1,21 @@
+# Multi-worker deployment on Linux: `gunicorn main:app` with this file in the
+# working directory. Binds and sizes the server from the same TIME_TRACKER_*
+# settings as `python main.py`.
+import os
+
+from settings import Settings
+
+settings = Settings()
+
+bind = "{}:{}".format(settings.host, settings.port)
+workers = settings.workers
+worker_class = "uvicorn.workers.UvicornWorker"
+# Each worker creates its own engine at startup, after the fork.
+preload_app = False
+
+
+def on_starting(server):
+    # The worker count may come from the command line (`-w 4`); pass the
+    # real one on to the workers, which turn their read cache off when there
+    # are several.
+    os.environ["TIME_TRACKER_WORKERS"] = str(server.cfg.workers)
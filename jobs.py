@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+
+# Background jobs for work that does not have to finish before the response,
+# such as recomputing an activity's totals after a batch or an import.
+#
+# Jobs have a key, e.g. ("activity", 3). A job submitted while another one
+# with the same key is still waiting is merged into it, so a burst of changes
+# to one activity is recomputed once. Jobs wait `delay` seconds before they
+# run to give bursts time to coalesce, and two jobs with the same key never
+# run at the same time. Jobs run on a fixed pool of threads; with no threads,
+# submit() runs the job right away.
+
+logger = logging.getLogger("time_tracker.jobs")
+
+
+class Job:
+    def __init__(self, key, function, items, submitted, due):
+        self.key = key
+        self.function = function
+        self.items = set(items)
+        self.submitted = submitted
+        self.due = due
+
+
+class JobQueue:
+    def __init__(self, workers=2, delay=0.5, metrics=None):
+        self.workers = workers
+        self.delay = delay
+        self.metrics = metrics
+        # Waiting jobs by key, oldest first.
+        self.pending = {}
+        self.running = set()
+        self.threads = []
+        self.closed = False
+        self.condition = threading.Condition()
+        self.processed = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.last_lag = 0.0
+
+    def submit(self, key, function, items=()):
+        """
+        Run function(items) in the background. If a job with the same key is
+        waiting, items are added to it and function is not called again.
+        """
+        if self.workers <= 0:
+            self._run(Job(key, function, items, time.monotonic(), 0))
+            return
+
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Job queue is closed")
+            job = self.pending.get(key)
+            if job is not None:
+                job.items.update(items)
+                self.coalesced += 1
+                return
+            now = time.monotonic()
+            self.pending[key] = Job(key, function, items, now, now + self.delay)
+            if len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._work, name="job-worker", daemon=True)
+                self.threads.append(thread)
+                thread.start()
+            self.condition.notify()
+
+    def flush(self, timeout=None):
+        """
+        Run every waiting job now and wait until all jobs are done. Returns
+        False if they did not finish within timeout seconds.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.condition:
+            for job in self.pending.values():
+                job.due = 0
+            self.condition.notify_all()
+            while self.pending or self.running:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def close(self, timeout=None):
+        """
+        Run the waiting jobs, then stop the worker threads. Used on shutdown.
+        """
+        flushed = self.flush(timeout)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+        return flushed
+
+    def stats(self):
+        with self.condition:
+            now = time.monotonic()
+            oldest = min((job.submitted for job in self.pending.values()), default=now)
+            return {"pending": len(self.pending), "running": len(self.running),
+                    "processed": self.processed, "coalesced": self.coalesced,
+                    "failed": self.failed, "oldest_pending_seconds": round(now - oldest, 6),
+                    "last_lag_seconds": round(self.last_lag, 6)}
+
+    def _next_job(self):
+        """
+        The first due job whose key is not running, or the time to wait for
+        one. Called with the condition held.
+        """
+        now = time.monotonic()
+        wait = None
+        for key, job in self.pending.items():
+            if key in self.running:
+                continue
+            if job.due <= now:
+                return job, None
+            wait = job.due - now if wait is None else min(wait, job.due - now)
+        return None, wait
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while True:
+                    job, wait = self._next_job()
+                    if job is not None:
+                        break
+                    if self.closed and not self.pending:
+                        return
+                    self.condition.wait(wait)
+                del self.pending[job.key]
+                self.running.add(job.key)
+
+            try:
+                self._run(job)
+            finally:
+                with self.condition:
+                    self.running.discard(job.key)
+                    self.condition.notify_all()
+
+    def _run(self, job):
+        started = time.monotonic()
+        try:
+            job.function(job.items)
+        except Exception:
+            logger.exception("background job failed", extra={"fields": {"key": repr(job.key)}})
+            with self.condition:
+                self.failed += 1
+        finished = time.monotonic()
+        with self.condition:
+            self.processed += 1
+            self.last_lag = finished - job.submitted
+        if self.metrics is not None:
+            self.metrics.job_duration.observe(finished - started)
+            self.metrics.job_lag.observe(finished - job.submitted)
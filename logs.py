@@ -0,0 +1,78 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+# Structured logging for the application's "time_tracker" loggers.
+#
+# Records are handed to a queue and written to stderr by a listener thread,
+# so request handlers never block on the output. Context is passed as
+# extra={"fields": {...}} and becomes top-level keys of the JSON line.
+
+LOGGER = "time_tracker"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        fields = getattr(record, "fields", {})
+        if fields:
+            text += " " + " ".join("{}={}".format(key, value) for key, value in fields.items())
+        return text
+
+
+def configure_logging(settings):
+    """
+    Send the application's log records through a queue to stderr. Returns
+    the listener, to be stopped on shutdown, or None if logging was already
+    configured.
+    """
+    logger = logging.getLogger(LOGGER)
+    if logger.handlers:
+        return None
+
+    if settings.log_format == "json":
+        formatter = JsonFormatter()
+    elif settings.log_format == "text":
+        formatter = TextFormatter("%(asctime)s %(levelname)s %(name)s %(message)s")
+    else:
+        raise ValueError("Unknown log format: {}".format(settings.log_format))
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(formatter)
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, output)
+
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.setLevel(settings.log_level.upper())
+    logger.propagate = False
+    listener.start()
+    return listener
+
+
+def stop_logging(listener):
+    """
+    Flush the queued records and remove the handler added by
+    configure_logging().
+    """
+    if listener is None:
+        return
+    listener.stop()
+    logger = logging.getLogger(LOGGER)
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+    logger.propagate = True
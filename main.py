@@ -1,28 +1,51 @@
-from typing import Annotated, List
-from fastapi import Depends, FastAPI, HTTPException
+import codecs
+import hashlib
+import logging
+import multiprocessing
+import os
+from functools import partial
+from typing import Annotated, List, Optional
+from fastapi import APIRouter, Depends, FastAPI, File, HTTPException, Query, Response, UploadFile
 from fastapi.openapi.docs import get_swagger_ui_html
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from sqlalchemy.orm import Session
+from starlette.datastructures import MutableHeaders
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, sessionmaker
 from starlette.requests import Request
+import orjson
 import uvicorn
 
-from database import Activity, Task, TimeEntry, SessionLocal
+from batch import run_batch
+from bulk import FORMATS, export_time_entries, import_time_entries
+from cache import ReadCache
+from database import Activity, DailyRollup, Task, TimeEntry, create_db_engine
+from events import EventBroker, stream_events
+from jobs import JobQueue
+from logs import configure_logging, stop_logging
+from metrics import AppMetrics, MetricsMiddleware, instrument_engine
+from migrations import check_schema_version
 from models import *
+from reports import get_report
+from rollups import (add_to_daily_rollups, apply_activity_delta, apply_time_entry_delta,
+                     detach_tasks, lock_activity, refresh_activity)
+from search import search_names
+from settings import Settings
 
 
-def get_db():
-    db = SessionLocal()
+logger = logging.getLogger("time_tracker")
+
+
+def get_db(request: Request):
+    db = request.app.state.SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
 
-# FastAPI setup
-app = FastAPI()
-
 origins = [
     "http://localhost:3000",
     "http://localhost:8000",
@@ -31,79 +54,211 @@ origins = [
     "*"
 ]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
+class UTF8ResponseMiddleware:
+    """
+    Declare the UTF-8 charset on JSON responses.
 
-class UTF8ResponseMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-        if "Content-Type" in response.headers:
-            if "application/json" in response.headers["Content-Type"]:
-                response.headers["Content-Type"] = "application/json; charset=utf-8"
-        return response
+    A plain ASGI middleware that only rewrites the response start message, so
+    bodies are passed through untouched and no extra task is spawned per
+    request.
+    """
 
+    def __init__(self, app):
+        self.app = app
 
-app.add_middleware(UTF8ResponseMiddleware)
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
+        async def send_with_charset(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                if "application/json" in headers.get("Content-Type", ""):
+                    headers["Content-Type"] = "application/json; charset=utf-8"
+            await send(message)
 
-def convert_minutes_to_hours_and_minutes(total_minutes):
-    hours = total_minutes // 60
-    remaining_minutes = total_minutes % 60
-    hours_with_minutes = hours + (remaining_minutes / 60)
-    return hours_with_minutes
+        await self.app(scope, receive, send_with_charset)
 
 
-async def update_task_duration(task_id):
+def render(request: Request, result, response: Response = None):
+    """
+    Build the response body for a row or a list of rows.
 
-    db = next(get_db())
+    With settings.fast_json the rows are serialized directly with orjson and
+    returned as a response, so FastAPI skips validating them against the
+    route's response_model. Otherwise the Pydantic response models are
+    returned as before.
+    """
+    if request.app.state.settings.fast_json:
+        headers = response.headers if response is not None else None
+        if isinstance(result, list):
+            return ORJSONResponse([row.to_dict() for row in result], headers=headers)
+        return ORJSONResponse(result.to_dict(), headers=headers)
 
-    task = db.query(Task).get(task_id)
+    if isinstance(result, list):
+        return [row.to_response_model() for row in result]
+    return result.to_response_model()
 
-    seconds = 0
-    for time_entry in task.time_entries:
-        seconds = seconds + time_entry.duration
 
-    task.duration = seconds // 60
+def render_data(request: Request, data, response: Response = None):
+    """
+    Like render(), for rows already converted with to_dict(), as the read
+    cache stores them.
+    """
+    if request.app.state.settings.fast_json:
+        headers = response.headers if response is not None else None
+        return ORJSONResponse(data, headers=headers)
+    return data
 
-    db.commit()
-    db.refresh(task)
-    db.close()
 
-    await update_activity_completed_hours(task.activity_id)
+def get_etag(pairs):
+    """
+    Weak ETag of rows given as (primary key, version) pairs.
+    """
+    text = ",".join("{}:{}".format(row_id, version) for row_id, version in pairs)
+    return 'W/"{}"'.format(hashlib.sha1(text.encode()).hexdigest())
 
 
-async def update_activity_completed_hours(activity_id):
+def etag_matches(request: Request, etag):
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or etag[2:] in tags
 
-    db = next(get_db())
 
-    activity = db.query(Activity).get(activity_id)
+def serve(request: Request, response: Response, query, key, cache_key=None,
+          limit=None, after=None, one=False, not_found="Not found"):
+    """
+    Serve a page of rows of query, or its only row when one is set, with a
+    weak ETag computed from the row versions.
 
-    minutes = 0
-    for task in activity.tasks:
-        print("Task {}: {}".format(task.task_id, task.duration))
-        minutes = minutes + task.duration
+    A matching If-None-Match is answered with 304 after reading only the
+    primary keys and versions, so nothing is loaded or serialized. With a
+    cache_key the rows are kept in the read cache as dicts, along with their
+    ETag and pagination cursor.
+    """
+    cache = request.app.state.cache
+    value = cache.get(cache_key) if cache_key is not None else None
 
-    activity.completed_hours = convert_minutes_to_hours_and_minutes(minutes)
-    activity.remaining_hours = activity.original_estimate - activity.completed_hours
+    if value is None:
+        generation = cache.generation
+        version = key.class_.version
+        fetch = (lambda query: query.all()) if one else (
+            lambda query: paginate(query, key, limit, after, response))
 
-    print("Complete hours: {} Remain hours: {}".format(
-        activity.completed_hours, activity.remaining_hours))
+        if request.headers.get("if-none-match") is not None:
+            pairs = fetch(query.with_entities(key, version))
+            if (pairs or not one) and etag_matches(request, get_etag(pairs)):
+                response.headers["ETag"] = get_etag(pairs)
+                return Response(status_code=304, headers=response.headers)
 
-    db.commit()
-    db.refresh(activity)
-    db.close()
+        rows = fetch(query)
+        if one and not rows:
+            raise HTTPException(status_code=404, detail=not_found)
+        data = rows[0].to_dict() if one else [row.to_dict() for row in rows]
+        etag = get_etag((getattr(row, key.key), row.version) for row in rows)
+        value = (data, response.headers.get("X-Next-After"), etag)
+        if cache_key is not None:
+            cache.set(cache_key, value, generation)
+
+    data, next_after, etag = value
+    if next_after is not None:
+        response.headers["X-Next-After"] = next_after
+    response.headers["ETag"] = etag
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=response.headers)
+    return render_data(request, data, response)
+
+
+def invalidate(request: Request, *prefixes):
+    """
+    Drop the read cache entries a write made stale.
+    """
+    request.app.state.cache.invalidate(*prefixes)
+
+
+def paginate(query, key, limit, after, response: Response):
+    """
+    Return one page of a query, in primary key order.
+
+    Pages are selected with "key > after" instead of an offset, so every page
+    costs the same however deep it is. When the page is full, the cursor for
+    the next one is sent in the X-Next-After header.
+    """
+    query = query.order_by(key)
+    if after is not None:
+        query = query.filter(key > after)
+    if limit is None:
+        return query.all()
+
+    rows = query.limit(limit).all()
+    if len(rows) == limit:
+        response.headers["X-Next-After"] = str(
+            getattr(rows[-1], key.key))
+    return rows
+
+
+def stream_ndjson(request: Request, db: Session, query):
+    """
+    Stream a query as newline-delimited JSON.
+
+    Rows are fetched from the cursor in small batches, so memory use does not
+    grow with the number of rows.
+    """
+    fast_json = request.app.state.settings.fast_json
+
+    def generate():
+        try:
+            for row in query.yield_per(500):
+                if fast_json:
+                    yield orjson.dumps(row.to_dict()) + b"\n"
+                else:
+                    yield row.to_response_model().json().encode() + b"\n"
+        finally:
+            db.close()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+def publish(request: Request, type, row):
+    """
+    Publish a committed change to the event stream subscribers.
+    """
+    request.app.state.events.publish(type, row.to_response_model().dict())
+
+
+def schedule_refresh(request: Request, db):
+    """
+    Callback for run_batch and import_time_entries that recomputes the
+    changed activities in background jobs, one per activity. An activity's
+    cache entries are dropped again once its totals are up to date.
+    """
+    app = request.app
+    bind = db.get_bind()
+
+    def refresh(activity_id, task_ids):
+        refresh_activity(bind, activity_id, task_ids)
+        app.state.cache.invalidate(("tasks", activity_id), ("activity", activity_id),
+                                   ("activities",))
+
+    def schedule(changes):
+        for activity_id, task_ids in changes.items():
+            app.state.jobs.submit(("activity", activity_id), partial(refresh, activity_id),
+                                  task_ids)
+
+    return schedule
+
+
+router = APIRouter()
 
 # API routes
 
 
-@app.post("/api/activities/", status_code=201)
-def create_activity(activity: ActivityCreate, db: Session = Depends(get_db)):
+@router.post("/api/activities/", status_code=201)
+def create_activity(activity: ActivityCreate, request: Request, db: Session = Depends(get_db)):
     """
     Create a new activity.
     """
@@ -117,24 +272,29 @@ def create_activity(activity: ActivityCreate, db: Session = Depends(get_db)):
     db.add(new_activity)
     db.commit()
     db.refresh(new_activity)
+    invalidate(request, ("activities",))
     db.close()
     return new_activity.to_response_model()
 
 
-@app.get("/api/activities/{activity_id}/", response_model=ActivityResponse)
-def get_activity(activity_id: int, db: Session = Depends(get_db)):
+@router.get("/api/activities/{activity_id}/", response_model=ActivityResponse)
+def get_activity(activity_id: int, request: Request, response: Response,
+                 db: Session = Depends(get_db)):
     """
     Get a specific activity by ID.
     """
-    activity = db.query(Activity).get(activity_id)
-    db.close()
-    if not activity:
-        raise HTTPException(status_code=404, detail="Activity not found")
-    return activity.to_response_model()
+    query = db.query(Activity).filter(Activity.activity_id == activity_id)
+    try:
+        return serve(request, response, query, Activity.activity_id,
+                     cache_key=("activity", activity_id), one=True,
+                     not_found="Activity not found")
+    finally:
+        db.close()
 
 
-@app.put("/api/activities/{activity_id}/", response_model=ActivityResponse)
-def update_activity(activity_id: int, activity: ActivityUpdate, db: Session = Depends(get_db)):
+@router.put("/api/activities/{activity_id}/", response_model=ActivityResponse)
+def update_activity(activity_id: int, activity: ActivityUpdate, request: Request,
+                    db: Session = Depends(get_db)):
     """
     Update an existing activity.
     """
@@ -144,43 +304,66 @@ def update_activity(activity_id: int, activity: ActivityUpdate, db: Session = De
 
     db_activity.name = activity.name
     db_activity.original_estimate = activity.original_estimate
-    db_activity.completed_hours = activity.completed_hours
+    # completed_hours follows the time entries, so the client's value is
+    # ignored; remaining_hours is derived from the stored one in SQL.
+    db_activity.remaining_hours = activity.original_estimate - func.coalesce(Activity.completed_hours, 0)
     db_activity.finalized = activity.finalized
     db_activity.price_per_hour = activity.price_per_hour
     db_activity.money_received = activity.money_received
 
     db.commit()
     db.refresh(db_activity)
+    invalidate(request, ("activity", activity_id), ("activities",))
+    publish(request, "activity.updated", db_activity)
     db.close()
     return db_activity.to_response_model()
 
 
-@app.delete("/api/activities/{activity_id}/", status_code=200)
-def delete_activity(activity_id: int, db: Session = Depends(get_db)):
+@router.delete("/api/activities/{activity_id}/", status_code=200)
+def delete_activity(activity_id: int, request: Request, db: Session = Depends(get_db)):
     """
     Delete an activity.
     """
     activity = db.query(Activity).get(activity_id)
     if not activity:
         raise HTTPException(status_code=404, detail="Activity not found")
+    detach_tasks(db, activity_id)
     db.delete(activity)
     db.commit()
+    invalidate(request, ("activity", activity_id), ("activities",), ("tasks", activity_id))
     db.close()
 
 
-@app.get("/api/activities/", response_model=List[ActivityResponse])
-def list_activities(finalized: bool = False, name: str = "", db: Session = Depends(get_db)):
+@router.get("/api/activities/", response_model=List[ActivityResponse])
+def list_activities(request: Request, response: Response, finalized: bool = False, name: str = "",
+                    limit: Optional[int] = Query(None, ge=1), after: Optional[int] = None,
+                    db: Session = Depends(get_db)):
     """
     List all activities.
     """
-    activities = db.query(Activity).filter(
-        Activity.finalized == finalized, Activity.name.contains(name)).all()
-    db.close()
-    return [activity.to_response_model() for activity in activities]
+    query = db.query(Activity).filter(
+        Activity.finalized == finalized, Activity.name.contains(name))
+    try:
+        return serve(request, response, query, Activity.activity_id,
+                     cache_key=("activities", finalized, name, limit, after),
+                     limit=limit, after=after)
+    finally:
+        db.close()
 
 
-@app.post("/api/tasks/", response_model=TaskResponse, status_code=201)
-def create_task(task: TaskCreate, db: Session = Depends(get_db)):
+@router.get("/api/activities/stream", response_class=StreamingResponse)
+def stream_activities(request: Request, finalized: bool = False, name: str = "",
+                      db: Session = Depends(get_db)):
+    """
+    Stream all activities as newline-delimited JSON.
+    """
+    query = db.query(Activity).filter(
+        Activity.finalized == finalized, Activity.name.contains(name)).order_by(Activity.activity_id)
+    return stream_ndjson(request, db, query)
+
+
+@router.post("/api/tasks/", response_model=TaskResponse, status_code=201)
+def create_task(task: TaskCreate, request: Request, db: Session = Depends(get_db)):
     """
     Create a new task.
     """
@@ -200,24 +383,26 @@ def create_task(task: TaskCreate, db: Session = Depends(get_db)):
     db.add(new_task)
     db.commit()
     db.refresh(new_task)
+    invalidate(request, ("tasks", task.activity_id))
     db.close()
     return new_task.to_response_model()
 
 
-@app.get("/api/tasks/{task_id}/", response_model=TaskResponse)
-def get_task(task_id: int, db: Session = Depends(get_db)):
+@router.get("/api/tasks/{task_id}/", response_model=TaskResponse)
+def get_task(task_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
     """
     Get a specific task by ID.
     """
-    task = db.query(Task).get(task_id)
-    db.close()
-    if not task:
-        raise HTTPException(status_code=404, detail="Task not found")
-    return task.to_response_model()
+    query = db.query(Task).filter(Task.task_id == task_id)
+    try:
+        return serve(request, response, query, Task.task_id, one=True,
+                     not_found="Task not found")
+    finally:
+        db.close()
 
 
-@app.put("/api/tasks/{task_id}/", response_model=TaskResponse)
-def update_task(task_id: int, task: TaskUpdate, db: Session = Depends(get_db)):
+@router.put("/api/tasks/{task_id}/", response_model=TaskResponse)
+def update_task(task_id: int, task: TaskUpdate, request: Request, db: Session = Depends(get_db)):
     """
     Update an existing task.
     """
@@ -227,12 +412,13 @@ def update_task(task_id: int, task: TaskUpdate, db: Session = Depends(get_db)):
     db_task.name = task.name
     db.commit()
     db.refresh(db_task)
+    invalidate(request, ("tasks", db_task.activity_id))
     db.close()
     return db_task.to_response_model()
 
 
-@app.put("/api/tasks/close/{task_id}/", response_model=TaskResponse)
-def close_task(task_id: int, db: Session = Depends(get_db)):
+@router.put("/api/tasks/close/{task_id}/", response_model=TaskResponse)
+def close_task(task_id: int, request: Request, db: Session = Depends(get_db)):
     """
     Update an existing task.
     """
@@ -245,17 +431,19 @@ def close_task(task_id: int, db: Session = Depends(get_db)):
 
     db.commit()
     db.refresh(db_task)
+    invalidate(request, ("tasks", db_task.activity_id))
+    publish(request, "task.closed", db_task)
     db.close()
 
     return db_task.to_response_model()
 
 
-@app.delete("/api/tasks/{task_id}/", status_code=200)
-async def delete_task(task_id: int, db: Session = Depends(get_db)):
+@router.delete("/api/tasks/{task_id}/", status_code=200)
+def delete_task(task_id: int, request: Request, db: Session = Depends(get_db)):
     """
     Delete a task.
     """
-    task = db.query(Task).get(task_id)
+    task = db.query(Task).options(joinedload(Task.activity)).get(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
@@ -263,30 +451,46 @@ async def delete_task(task_id: int, db: Session = Depends(get_db)):
         raise HTTPException(
             status_code=400, detail="You can't delete a task with finalized activity")
 
+    activity_id = task.activity_id
+    lock_activity(db, activity_id)
+    # The duration is read in the UPDATE, after the lock: the loaded one can
+    # miss a stop committed in between.
+    duration = select(func.coalesce(Task.duration, 0)).where(
+        Task.task_id == task_id).scalar_subquery()
+    apply_activity_delta(db, activity_id, -duration / 60)
+    db.query(TimeEntry).filter(TimeEntry.task_id == task_id).delete(
+        synchronize_session=False)
+    db.query(DailyRollup).filter(DailyRollup.task_id == task_id).delete(
+        synchronize_session=False)
     db.delete(task)
+
     db.commit()
+    invalidate(request, ("tasks", activity_id), ("activity", activity_id), ("activities",))
     db.close()
 
-    await update_activity_completed_hours(task.activity_id)
 
-
-@app.get("/api/tasks/activity/{activity_id}/", response_model=List[TaskResponse])
-async def list_tasks(activity_id: int, db: Session = Depends(get_db)):
+@router.get("/api/tasks/activity/{activity_id}/", response_model=List[TaskResponse])
+def list_tasks(activity_id: int, request: Request, response: Response,
+               limit: Optional[int] = Query(None, ge=1), after: Optional[int] = None,
+               db: Session = Depends(get_db)):
     """
     List tasks of a specific activity.
     """
-    # ... implementation ...
-    tasks = db.query(Task).filter(Task.activity_id == activity_id).all()
-    db.close()
-    return [task.to_response_model() for task in tasks]
+    query = db.query(Task).filter(Task.activity_id == activity_id)
+    try:
+        return serve(request, response, query, Task.task_id,
+                     cache_key=("tasks", activity_id, limit, after),
+                     limit=limit, after=after)
+    finally:
+        db.close()
 
 
-@app.post("/api/time_entries/{task_id}/start", response_model=TimeEntryResponse)
-def create_time_entry(task_id: int, db: Session = Depends(get_db)):
+@router.post("/api/time_entries/{task_id}/start", response_model=TimeEntryResponse)
+def create_time_entry(task_id: int, request: Request, db: Session = Depends(get_db)):
     """
     Create a new time entry.
     """
-    task = db.query(Task).get(task_id)
+    task = db.query(Task).options(joinedload(Task.activity)).get(task_id)
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
@@ -311,65 +515,105 @@ def create_time_entry(task_id: int, db: Session = Depends(get_db)):
 
     if task.start_time is None:
         task.start_time = start_time
+    activity_id = task.activity_id
 
-    db.commit()
+    # ix_time_entries_running is unique, so of concurrent starts on a task
+    # only the first one commits.
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Task already has a running time entry")
     db.refresh(new_time_entry)
-    db.refresh(task)
+    invalidate(request, ("tasks", activity_id))
+    publish(request, "time_entry.started", new_time_entry)
     db.close()
     return new_time_entry.to_response_model()
 
 # Add a new endpoint to stop a time entry
 
 
-@app.put("/api/time_entries/{time_entry_id}/stop", response_model=TimeEntryResponse)
-async def stop_time_entry(time_entry_id: int, db: Session = Depends(get_db)):
+@router.put("/api/time_entries/{time_entry_id}/stop", response_model=TimeEntryResponse)
+def stop_time_entry(time_entry_id: int, request: Request, db: Session = Depends(get_db)):
     """
-    Stop a time entry by ID.
+    Stop a time entry by ID. Stopping an entry that is already stopped returns
+    it unchanged.
     """
-    time_entry = db.query(TimeEntry).get(time_entry_id)
+    time_entry = db.query(TimeEntry).options(joinedload(TimeEntry.task)).get(time_entry_id)
     if not time_entry:
         raise HTTPException(status_code=404, detail="Time Entry not found")
-
-    time_entry.end_time = datetime.now()
-
-    duration = time_entry.end_time - time_entry.start_time
-    time_entry.duration = duration.total_seconds()
-
-    db.commit()
-    db.refresh(time_entry)
+    activity_id = time_entry.task.activity_id
+
+    if time_entry.end_time is None:
+        end_time = datetime.now()
+        duration = (end_time - time_entry.start_time).total_seconds()
+
+        # Only the request whose UPDATE stops the entry applies its duration,
+        # a concurrent stop of the same entry matches no row. The activity
+        # lock keeps a background refresh from running in between.
+        lock_activity(db, activity_id)
+        stopped = db.execute(
+            update(TimeEntry)
+            .where(TimeEntry.time_entry_id == time_entry_id, TimeEntry.end_time == None)
+            .values(end_time=end_time, duration=duration, version=TimeEntry.version + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if stopped:
+            apply_time_entry_delta(db, time_entry.task_id, duration)
+            add_to_daily_rollups(db, time_entry.task_id, activity_id,
+                                 time_entry.start_time, end_time)
+
+        db.commit()
+        db.refresh(time_entry)
+        if stopped:
+            invalidate(request, ("tasks", activity_id), ("activity", activity_id), ("activities",))
+            publish(request, "time_entry.stopped", time_entry)
     db.close()
 
-    await update_task_duration(time_entry.task_id)
-
     return time_entry.to_response_model()
 
 
-@app.get("/api/time_entries/{time_entry_id}/", response_model=TimeEntryResponse)
-def get_time_entry(time_entry_id: int, db: Session = Depends(get_db)):
+@router.get("/api/time_entries/{time_entry_id}/", response_model=TimeEntryResponse)
+def get_time_entry(time_entry_id: int, request: Request, response: Response,
+                   db: Session = Depends(get_db)):
     """
     Get a specific time entry by ID.
     """
-    time_entry = db.query(TimeEntry).get(time_entry_id)
-    db.close()
-    if not time_entry:
-        raise HTTPException(status_code=404, detail="Time Entry not found")
-    return time_entry.to_response_model()
+    query = db.query(TimeEntry).filter(TimeEntry.time_entry_id == time_entry_id)
+    try:
+        return serve(request, response, query, TimeEntry.time_entry_id, one=True,
+                     not_found="Time Entry not found")
+    finally:
+        db.close()
 
 
-@app.get("/api/time_entries/task/{task_id}/", response_model=List[TimeEntryResponse])
-async def list_time_entries(task_id: int, db: Session = Depends(get_db)):
+@router.get("/api/time_entries/task/{task_id}/", response_model=List[TimeEntryResponse])
+def list_time_entries(task_id: int, request: Request, response: Response,
+                      limit: Optional[int] = Query(None, ge=1), after: Optional[int] = None,
+                      db: Session = Depends(get_db)):
     """
     List time entries of a specific task.
     """
-    # ... implementation ...
-    time_entries = db.query(TimeEntry).filter(
-        TimeEntry.task_id == task_id).all()
-    db.close()
-    return [time_entry.to_response_model() for time_entry in time_entries]
+    query = db.query(TimeEntry).filter(TimeEntry.task_id == task_id)
+    try:
+        return serve(request, response, query, TimeEntry.time_entry_id,
+                     limit=limit, after=after)
+    finally:
+        db.close()
+
+
+@router.get("/api/time_entries/task/{task_id}/stream", response_class=StreamingResponse)
+def stream_time_entries(task_id: int, request: Request, db: Session = Depends(get_db)):
+    """
+    Stream time entries of a specific task as newline-delimited JSON.
+    """
+    query = db.query(TimeEntry).filter(
+        TimeEntry.task_id == task_id).order_by(TimeEntry.time_entry_id)
+    return stream_ndjson(request, db, query)
 
 
-@app.get("/api/time_entries/task/{task_id}/playing", response_model=TimeEntryResponse)
-def get_time_entry(task_id: int, db: Session = Depends(get_db)):
+@router.get("/api/time_entries/task/{task_id}/playing", response_model=TimeEntryResponse)
+def get_time_entry(task_id: int, request: Request, db: Session = Depends(get_db)):
     """
     Get the active time entry for a specific task.
     """
@@ -378,15 +622,145 @@ def get_time_entry(task_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Task not found")
 
     active_time_entry = db.query(TimeEntry).filter(
-        TimeEntry.task_id == task_id, TimeEntry.end_time == None).first()
+        TimeEntry.task_id == task_id, TimeEntry.end_time == None).one_or_none()
     if not active_time_entry:
         raise HTTPException(
             status_code=404, detail="No time entry without end time")
 
-    return active_time_entry.to_response_model()
+    return render(request, active_time_entry)
+
+
+@router.post("/api/time_entries/import", response_model=ImportResult)
+def import_entries(request: Request, file: UploadFile = File(...), format: Optional[str] = None,
+                   db: Session = Depends(get_db)):
+    """
+    Import stopped time entries from a CSV or NDJSON upload.
+
+    The format is taken from the file name unless given. Invalid rows are
+    skipped and reported; task and activity totals are recomputed once at
+    the end. If the file is not valid UTF-8, the import stops at the batch
+    holding the invalid bytes and the result has complete false and the
+    last line imported.
+    """
+    if format is None:
+        format = "csv" if (file.filename or "").endswith(".csv") else "ndjson"
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail="Unknown format")
+
+    stream = codecs.iterdecode(file.file, "utf-8-sig")
+    result = import_time_entries(db, stream, format, schedule=schedule_refresh(request, db))
+    logger.info("time entries imported", extra={"fields": {
+        "imported": result.imported, "skipped": result.skipped,
+        "complete": result.complete}})
+    request.app.state.cache.clear()
+    db.close()
+    return result
+
+
+@router.get("/api/time_entries/export", response_class=StreamingResponse)
+def export_entries(format: str = "ndjson", activity_id: Optional[int] = None,
+                   task_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Export stopped time entries as CSV or NDJSON, in the import format.
+    """
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail="Unknown format")
+
+    task_ids = [task_id] if task_id is not None else None
+
+    def generate():
+        try:
+            yield from export_time_entries(db, format, task_ids, activity_id)
+        finally:
+            db.close()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(generate(), media_type=media_type)
+
+
+@router.get("/api/reports", response_model=List[ReportRow])
+def list_reports(bucket: ReportBucket = ReportBucket.day, start: Optional[date] = None,
+                 end: Optional[date] = None, activity_id: Optional[int] = None,
+                 db: Session = Depends(get_db)):
+    """
+    Hours and billable, paid and unpaid amounts per activity and day, week or
+    month. start and end are inclusive dates.
+    """
+    report = get_report(db, bucket, start, end, activity_id)
+    db.close()
+    return report
+
+
+@router.get("/api/search", response_model=List[SearchResult])
+def search(q: str, limit: int = Query(20, ge=1, le=100), type: Optional[SearchType] = None,
+           db: Session = Depends(get_db)):
+    """
+    Activities and tasks whose names have words starting with each word of
+    q, best matches first.
+    """
+    results = search_names(db, q, limit, type)
+    db.close()
+    return results
+
+
+@router.post("/api/batch", response_model=List[BatchResult])
+def batch(operations: List[BatchOperation], request: Request, db: Session = Depends(get_db)):
+    """
+    Apply create, update and delete operations on activities, tasks and time
+    entries in one transaction. If any operation fails nothing is saved and
+    the error detail gives the index of the failing operation.
+    """
+    try:
+        results = run_batch(db, operations, schedule_refresh(request, db))
+    finally:
+        db.close()
+    request.app.state.cache.clear()
+    return results
+
+
+@router.get("/api/events", response_class=StreamingResponse)
+async def stream_change_events(request: Request):
+    """
+    Server-sent events for started and stopped time entries, closed tasks and
+    updated activities. Each event carries the row as the matching GET
+    endpoint returns it.
+    """
+    broker = request.app.state.events
+    return StreamingResponse(
+        stream_events(broker, broker.subscribe()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/api/cache")
+def get_cache_stats(request: Request):
+    """
+    Hit and miss counters of the read cache.
+    """
+    return request.app.state.cache.stats()
+
+
+@router.get("/api/jobs")
+def get_job_stats(request: Request):
+    """
+    Depth and lag of the background job queue: waiting and running jobs,
+    the age of the oldest waiting one and how long the last one took from
+    its first submit to completion.
+    """
+    return request.app.state.jobs.stats()
+
 
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics(request: Request):
+    """
+    Request, SQL, pool and cache metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(request.app.state.metrics.registry.render(),
+                             media_type="text/plain; version=0.0.4")
 
-@app.get("/api/docs", include_in_schema=False)
+
+@router.get("/api/docs", include_in_schema=False)
 async def custom_swagger_ui_html():
     """
     Custom route for Swagger UI HTML.
@@ -394,12 +768,12 @@ async def custom_swagger_ui_html():
     return get_swagger_ui_html(openapi_url="/openapi.json", title="API Docs")
 
 
-@app.get("/api/openapi.json", include_in_schema=False)
-async def get_openapi_json():
+@router.get("/api/openapi.json", include_in_schema=False)
+async def get_openapi_json(request: Request):
     """
     Get the OpenAPI schema in JSON format.
     """
-    return app.openapi()
+    return request.app.openapi()
 
 
 def custom_openapi():
@@ -410,8 +784,95 @@ def custom_openapi():
         return app.openapi_schema
 
 
-app.mount("/", StaticFiles(directory="ui/time_tracker_ui/build/web", html=True))
+def get_cache_size(settings):
+    """
+    The read cache size. A worker's cache is not invalidated by writes made
+    through other workers, so with several workers the cache is off unless
+    TIME_TRACKER_CACHE_SIZE is set explicitly.
+
+    gunicorn.conf.py sets TIME_TRACKER_WORKERS from the real worker count.
+    `uvicorn --workers` (and `--reload`) run the app in processes started
+    with multiprocessing, which is taken as several workers.
+    """
+    several = settings.workers > 1 or multiprocessing.parent_process() is not None
+    if several and "cache_size" not in settings.__fields_set__:
+        return 0
+    return settings.cache_size
+
+
+def create_app(settings=None):
+    """
+    Build the FastAPI application.
+
+    Nothing touches the database or the file system here: the engine, the
+    session factory and the static files mount are set up when the
+    application starts.
+    """
+    if settings is None:
+        settings = Settings()
+
+    app = FastAPI()
+    app.state.settings = settings
+    app.state.events = EventBroker()
+    app.state.cache = ReadCache(get_cache_size(settings), settings.cache_ttl)
+    app.state.metrics = AppMetrics()
+    app.state.metrics.watch_cache(app.state.cache)
+    app.state.jobs = JobQueue(settings.job_workers, settings.job_delay, app.state.metrics)
+    app.state.metrics.watch_jobs(app.state.jobs)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["ETag", "X-Next-After"],
+    )
+    app.add_middleware(UTF8ResponseMiddleware)
+    app.add_middleware(MetricsMiddleware, metrics=app.state.metrics, router=app.router,
+                       slow_request_seconds=settings.slow_request_seconds)
+
+    app.include_router(router)
+
+    @app.on_event("startup")
+    def startup():
+        app.state.log_listener = configure_logging(settings)
+        app.state.engine = create_db_engine(settings)
+        instrument_engine(app.state.engine, app.state.metrics)
+        app.state.SessionLocal = sessionmaker(
+            autocommit=False, autoflush=False, bind=app.state.engine)
+        check_schema_version(app.state.engine)
+
+        if os.path.isdir(settings.static_directory) and not any(
+                getattr(route, "name", None) == "static" for route in app.routes):
+            app.mount("/", StaticFiles(directory=settings.static_directory,
+                                       html=True), name="static")
+        logger.info("application started", extra={"fields": {
+            "database": app.state.engine.dialect.name, "pool_size": settings.pool_size,
+            "pid": os.getpid()}})
+        if (settings.workers > 1 and app.state.engine.dialect.name == "sqlite"
+                and settings.sqlite_profile != "production"):
+            # Without WAL and a busy timeout, concurrent writers from other
+            # workers fail at once with "database is locked".
+            logger.warning("several workers share a SQLite database without "
+                           "TIME_TRACKER_SQLITE_PROFILE=production")
+
+    @app.on_event("shutdown")
+    def shutdown():
+        app.state.events.close()
+        # Pending recomputes still need the engine.
+        app.state.jobs.close()
+        app.state.engine.dispose()
+        logger.info("application stopped")
+        stop_logging(app.state.log_listener)
+
+    return app
+
+
+app = create_app()
 
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=5001, log_level="info")
\ No newline at end of file
+    settings = Settings()
+    uvicorn.run("main:app", host=settings.host, port=settings.port, workers=settings.workers,
+                log_level="info")
\ No newline at end of file
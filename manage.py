@@ -0,0 +1,174 @@
+import argparse
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy.orm import sessionmaker
+
+from bulk import FORMATS, export_time_entries, import_time_entries
+from database import create_db_engine
+from generator import DISTRIBUTIONS, generate, is_empty
+from migrations import migrate
+from rollups import rebuild_daily_rollups, reconcile
+from settings import Settings
+
+
+def run_migrate(args):
+    """
+    Bring the database schema up to date.
+    """
+    applied = migrate(args.engine)
+    if applied:
+        print("Applied migrations: {}".format(", ".join(map(str, applied))))
+    else:
+        print("Database schema is up to date")
+
+
+def run_reconcile(args):
+    """
+    Recompute task durations and activity hours from the time entries.
+    """
+    db = sessionmaker(bind=args.engine)()
+    try:
+        reconcile(db)
+        db.commit()
+    finally:
+        db.close()
+    print("Rollups reconciled")
+
+
+def run_rebuild_rollups(args):
+    """
+    Regenerate the daily rollups from the time entries.
+    """
+    db = sessionmaker(bind=args.engine)()
+    try:
+        rebuild_daily_rollups(db)
+        db.commit()
+    finally:
+        db.close()
+    print("Daily rollups rebuilt")
+
+
+def get_format(args):
+    if args.format:
+        return args.format
+    return "csv" if args.path.endswith(".csv") else "ndjson"
+
+
+def run_import_entries(args):
+    """
+    Import time entries from a CSV or NDJSON file ("-" for stdin).
+    """
+    db = sessionmaker(bind=args.engine)()
+    try:
+        if args.path == "-":
+            result = import_time_entries(db, sys.stdin, get_format(args))
+        else:
+            with open(args.path, newline="", encoding="utf-8-sig") as stream:
+                result = import_time_entries(db, stream, get_format(args))
+    finally:
+        db.close()
+
+    print("Imported {} time entries, skipped {}".format(result.imported, result.skipped))
+    for error in result.errors:
+        print("line {}: {}".format(error.line, error.message), file=sys.stderr)
+    if not result.complete:
+        sys.exit(1)
+
+
+def run_export_entries(args):
+    """
+    Export stopped time entries to a CSV or NDJSON file ("-" for stdout).
+    """
+    db = sessionmaker(bind=args.engine)()
+    try:
+        chunks = export_time_entries(db, get_format(args), activity_id=args.activity_id)
+        if args.path == "-":
+            sys.stdout.writelines(chunks)
+        else:
+            with open(args.path, "w", newline="", encoding="utf-8") as stream:
+                stream.writelines(chunks)
+    finally:
+        db.close()
+
+
+def run_generate(args):
+    """
+    Fill an empty database with a deterministic synthetic dataset.
+    """
+    migrate(args.engine)
+    started = time.perf_counter()
+    with args.engine.begin() as connection:
+        if not is_empty(connection):
+            print("The database already has data, generate needs an empty one", file=sys.stderr)
+            sys.exit(1)
+        written = generate(
+            connection, activities=args.activities, tasks=args.tasks, entries=args.entries,
+            seed=args.seed, distribution=args.distribution, open_fraction=args.open_fraction,
+            finalized_fraction=args.finalized_fraction, years=args.years, end=args.end,
+            batch_size=args.batch_size)
+    print("Generated {} activities, {} tasks, {} time entries and {} daily rollups in {:.1f} s".format(
+        written["activities"], written["tasks"], written["time_entries"],
+        written["daily_rollups"], time.perf_counter() - started))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Maintenance commands for the time tracker database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands.add_parser(
+        "migrate", help="apply pending schema migrations")
+    migrate_parser.set_defaults(handler=run_migrate)
+
+    reconcile_parser = commands.add_parser(
+        "reconcile", help="recompute task durations and activity hours")
+    reconcile_parser.set_defaults(handler=run_reconcile)
+
+    rebuild_parser = commands.add_parser(
+        "rebuild-rollups", help="regenerate the daily rollups from the time entries")
+    rebuild_parser.set_defaults(handler=run_rebuild_rollups)
+
+    import_parser = commands.add_parser(
+        "import-entries", help="import time entries from CSV or NDJSON")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=FORMATS)
+    import_parser.set_defaults(handler=run_import_entries)
+
+    export_parser = commands.add_parser(
+        "export-entries", help="export stopped time entries to CSV or NDJSON")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--format", choices=FORMATS)
+    export_parser.add_argument("--activity-id", type=int)
+    export_parser.set_defaults(handler=run_export_entries)
+
+    generate_parser = commands.add_parser(
+        "generate", help="fill an empty database with synthetic data")
+    generate_parser.add_argument("--activities", type=int, default=100)
+    generate_parser.add_argument("--tasks", type=int, default=1000)
+    generate_parser.add_argument("--entries", type=int, default=100000)
+    generate_parser.add_argument("--seed", type=int, default=0)
+    generate_parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="uniform",
+                                 help="how tasks and entries are spread over their parents")
+    generate_parser.add_argument("--open-fraction", type=float, default=0.05,
+                                 help="share of open tasks with a long-running entry")
+    generate_parser.add_argument("--finalized-fraction", type=float, default=0.2,
+                                 help="share of finalized activities")
+    generate_parser.add_argument("--years", type=int, default=3,
+                                 help="years of history before --end")
+    generate_parser.add_argument("--end", type=datetime.fromisoformat,
+                                 default=datetime(2025, 1, 1))
+    generate_parser.add_argument("--batch-size", type=int, default=100000)
+    generate_parser.set_defaults(handler=run_generate)
+
+    args = parser.parse_args(argv)
+    args.engine = create_db_engine(Settings())
+    try:
+        args.handler(args)
+    finally:
+        args.engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+# Prometheus metrics, rendered in the text exposition format by /metrics.
+#
+# A small registry instead of prometheus_client: the application runs in one
+# process per worker and only needs counters, callback gauges and histograms.
+
+logger = logging.getLogger("time_tracker.requests")
+
+# [statements, seconds] of SQL run for the current request, see
+# MetricsMiddleware. Handlers run in the threadpool with a copy of the
+# request's context, which still refers to the same list.
+request_sql = ContextVar("request_sql", default=None)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\")
+                         .replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Called at render time instead of keeping a value.
+        self.function = function
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def samples(self):
+        if self.function is not None:
+            yield self.name, "", self.function()
+            return
+        with self.lock:
+            values = dict(self.values)
+        for labels, value in sorted(values.items()):
+            yield self.name, format_labels(self.labelnames, labels), value
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation),
+                 "# TYPE {} {}".format(self.name, self.type)]
+        for name, labels, value in self.samples():
+            lines.append("{}{} {}".format(name, labels, format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, labels=()):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, labels=()):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, labels=()):
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                # One count per bucket, then the sum.
+                counts = self.values[labels] = [0] * len(self.buckets) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = {labels: list(counts) for labels, counts in self.values.items()}
+        for labels, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (self.name + "_bucket",
+                       format_labels(self.labelnames, labels, [("le", format_value(bound))]),
+                       cumulative)
+            label_text = format_labels(self.labelnames, labels)
+            yield self.name + "_sum", label_text, counts[-1]
+            yield self.name + "_count", label_text, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class AppMetrics:
+    """
+    The application's metrics. One instance per app, on app.state.metrics.
+    """
+
+    def __init__(self):
+        self.registry = Registry()
+        register = self.registry.register
+        self.requests = register(Histogram(
+            "http_request_duration_seconds", "Request latency by route.",
+            ["method", "route", "status"]))
+        self.request_statements = register(Histogram(
+            "http_request_sql_statements", "SQL statements run per request.",
+            ["route"], STATEMENT_BUCKETS))
+        self.request_sql_seconds = register(Histogram(
+            "http_request_sql_duration_seconds", "Time spent in SQL per request.",
+            ["route"]))
+        self.statements = register(Counter(
+            "sql_statements_total", "SQL statements executed."))
+        self.sql_seconds = register(Counter(
+            "sql_duration_seconds_total", "Time spent executing SQL statements."))
+        self.commits = register(Counter("db_commits_total", "Transactions committed."))
+        self.rollbacks = register(Counter("db_rollbacks_total", "Transactions rolled back."))
+        self.connects = register(Counter(
+            "db_pool_connections_total", "Database connections opened by the pool."))
+        self.checkouts = register(Counter(
+            "db_pool_checkouts_total", "Connections checked out of the pool."))
+
+        self.job_duration = register(Histogram(
+            "background_job_duration_seconds", "Time spent running background jobs."))
+        self.job_lag = register(Histogram(
+            "background_job_lag_seconds",
+            "Time from a background job's first submit to its completion."))
+
+        # Read at render time from the pool, the read cache and the job queue.
+        self.pool = None
+        self.cache = None
+        self.jobs = None
+        register(Gauge(
+            "db_pool_checked_out", "Connections currently checked out.",
+            function=lambda: self.pool.checkedout() if hasattr(self.pool, "checkedout") else 0))
+        register(Gauge(
+            "db_pool_overflow", "Connections open beyond pool_size.",
+            function=lambda: max(self.pool.overflow(), 0) if hasattr(self.pool, "overflow") else 0))
+        register(Counter(
+            "read_cache_hits_total", "Read cache hits.",
+            function=lambda: self.cache.hits if self.cache is not None else 0))
+        register(Counter(
+            "read_cache_misses_total", "Read cache misses.",
+            function=lambda: self.cache.misses if self.cache is not None else 0))
+        register(Gauge(
+            "background_jobs_pending", "Background jobs waiting to run.",
+            function=lambda: self.jobs.stats()["pending"] if self.jobs is not None else 0))
+        register(Gauge(
+            "background_jobs_oldest_pending_seconds",
+            "Age of the oldest waiting background job.",
+            function=lambda: self.jobs.stats()["oldest_pending_seconds"] if self.jobs is not None else 0))
+        register(Counter(
+            "background_jobs_total", "Background jobs run.",
+            function=lambda: self.jobs.processed if self.jobs is not None else 0))
+        register(Counter(
+            "background_jobs_coalesced_total", "Submits merged into a waiting job.",
+            function=lambda: self.jobs.coalesced if self.jobs is not None else 0))
+        register(Counter(
+            "background_jobs_failed_total", "Background jobs that raised.",
+            function=lambda: self.jobs.failed if self.jobs is not None else 0))
+
+    def watch_pool(self, engine):
+        """
+        Report the state of the engine's connection pool.
+        """
+        self.pool = engine.pool
+
+    def watch_cache(self, cache):
+        self.cache = cache
+
+    def watch_jobs(self, jobs):
+        self.jobs = jobs
+
+
+def instrument_engine(engine, metrics):
+    """
+    Count SQL statements, their time, commits, rollbacks and pool activity
+    on an engine, per process and per request.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        metrics.statements.inc()
+        metrics.sql_seconds.inc(elapsed)
+        current = request_sql.get()
+        if current is not None:
+            current[0] += 1
+            current[1] += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("query_started") if context.connection else None
+        if started:
+            started.pop()
+
+    event.listen(engine, "commit", lambda conn: metrics.commits.inc())
+    event.listen(engine, "rollback", lambda conn: metrics.rollbacks.inc())
+    event.listen(engine, "connect", lambda dbapi_connection, record: metrics.connects.inc())
+    event.listen(engine, "checkout",
+                 lambda dbapi_connection, record, proxy: metrics.checkouts.inc())
+    metrics.watch_pool(engine)
+
+
+def get_route_path(routes, scope):
+    """
+    Path template of the route handling a request, used as the route label
+    so the number of label values stays bounded.
+    """
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path or "/"
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    Record latency and SQL use per request, and log slow requests.
+
+    Like UTF8ResponseMiddleware, a plain ASGI middleware that only watches
+    the response start message.
+    """
+
+    def __init__(self, app, metrics, router, slow_request_seconds):
+        self.app = app
+        self.metrics = metrics
+        self.router = router
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500]
+        sql = [0, 0.0]
+        token = request_sql.set(sql)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_sql.reset(token)
+            elapsed = time.perf_counter() - started
+            route = get_route_path(self.router.routes, scope)
+            self.metrics.requests.observe(elapsed, (scope["method"], route, str(status[0])))
+            self.metrics.request_statements.observe(sql[0], (route,))
+            self.metrics.request_sql_seconds.observe(sql[1], (route,))
+
+            fields = {"method": scope["method"], "route": route, "path": scope["path"],
+                      "status": status[0], "duration": round(elapsed, 6),
+                      "sql_statements": sql[0], "sql_duration": round(sql[1], 6)}
+            if elapsed >= self.slow_request_seconds:
+                logger.warning("slow request", extra={"fields": fields})
+            elif logger.isEnabledFor(logging.DEBUG):
+                logger.debug("request", extra={"fields": fields})
@@ -0,0 +1,264 @@
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import (Boolean, Column, Date, DateTime, Float, ForeignKey, Index, Integer,
+                        MetaData, String, Table, inspect, select, text)
+
+# Versioned schema migrations.
+#
+# Each migration describes the tables it touches with its own MetaData instead
+# of importing the models, so it keeps producing the same schema after the
+# models in database.py move on. The applied version is stored in the
+# schema_version table.
+
+MIGRATIONS = []
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, nullable=False)
+)
+
+
+def migration(version):
+    def register(upgrade):
+        MIGRATIONS.append((version, upgrade))
+        return upgrade
+    return register
+
+
+@migration(1)
+def create_initial_schema(connection):
+    """
+    Tables as created by create_all() before migrations existed. Existing
+    tables are left alone, so older databases are adopted as version 1.
+    """
+    metadata = MetaData()
+    Table(
+        "activities", metadata,
+        Column("activity_id", Integer, primary_key=True),
+        Column("name", String(255)),
+        Column("original_estimate", Float),
+        Column("remaining_hours", Float),
+        Column("completed_hours", Float),
+        Column("finalized", Boolean),
+        Column("price_per_hour", Float),
+        Column("money_received", Boolean)
+    )
+    Table(
+        "tasks", metadata,
+        Column("task_id", Integer, primary_key=True),
+        Column("activity_id", Integer, ForeignKey("activities.activity_id")),
+        Column("name", String(255)),
+        Column("start_time", DateTime, nullable=True),
+        Column("end_time", DateTime, nullable=True),
+        Column("duration", Float),
+        Column("closed", Boolean)
+    )
+    Table(
+        "time_entries", metadata,
+        Column("time_entry_id", Integer, primary_key=True),
+        Column("task_id", Integer, ForeignKey(
+            "tasks.task_id", ondelete="CASCADE")),
+        Column("start_time", DateTime),
+        Column("end_time", DateTime, nullable=True),
+        Column("duration", Float, nullable=True)
+    )
+    metadata.create_all(bind=connection)
+
+
+@migration(2)
+def add_lookup_indexes(connection):
+    """
+    Index the foreign keys used by the list endpoints and the running
+    entries used by /playing.
+    """
+    metadata = MetaData()
+    tasks = Table("tasks", metadata, autoload_with=connection)
+    time_entries = Table("time_entries", metadata, autoload_with=connection)
+    indexes = [
+        Index("ix_tasks_activity_id", tasks.c.activity_id),
+        Index("ix_time_entries_task_id", time_entries.c.task_id),
+        Index(
+            "ix_time_entries_running",
+            time_entries.c.task_id,
+            sqlite_where=text("end_time IS NULL"),
+            postgresql_where=text("end_time IS NULL")
+        )
+    ]
+    for index in indexes:
+        index.create(bind=connection, checkfirst=True)
+
+
+@migration(3)
+def add_daily_rollups(connection):
+    """
+    Per task and day totals used by the reports, filled from the existing
+    time entries.
+    """
+    metadata = MetaData()
+    Table("activities", metadata, autoload_with=connection)
+    tasks = Table("tasks", metadata, autoload_with=connection)
+    time_entries = Table("time_entries", metadata, autoload_with=connection)
+    daily_rollups = Table(
+        "daily_rollups", metadata,
+        Column("task_id", Integer, ForeignKey(
+            "tasks.task_id", ondelete="CASCADE"), primary_key=True),
+        Column("date", Date, primary_key=True),
+        Column("activity_id", Integer, ForeignKey("activities.activity_id")),
+        Column("seconds", Float, nullable=False)
+    )
+    Index("ix_daily_rollups_activity_id_date",
+          daily_rollups.c.activity_id, daily_rollups.c.date)
+    daily_rollups.create(bind=connection, checkfirst=True)
+
+    # A copy of rollups.rebuild_daily_rollups as it was when this migration
+    # was written: stopped entries, split at midnight.
+    entries = (
+        select(time_entries.c.task_id, tasks.c.activity_id,
+               time_entries.c.start_time, time_entries.c.end_time)
+        .join(tasks, tasks.c.task_id == time_entries.c.task_id)
+        .where(time_entries.c.end_time != None)
+    )
+    totals = {}
+    for task_id, activity_id, start_time, end_time in connection.execute(entries):
+        while start_time < end_time:
+            midnight = datetime.combine(start_time.date() + timedelta(days=1), time.min)
+            day_end = min(midnight, end_time)
+            key = (task_id, start_time.date())
+            if key not in totals:
+                totals[key] = [activity_id, 0.0]
+            totals[key][1] += (day_end - start_time).total_seconds()
+            start_time = day_end
+
+    rows = [
+        {"task_id": task_id, "date": date, "activity_id": activity_id, "seconds": seconds}
+        for (task_id, date), (activity_id, seconds) in totals.items()
+    ]
+    if rows:
+        connection.execute(daily_rollups.insert(), rows)
+
+
+@migration(4)
+def add_row_versions(connection):
+    """
+    Version counters used for the ETags of the read endpoints.
+
+    The running entries index gains end_time, as the wider rows made SQLite
+    pick ix_time_entries_task_id for /playing instead.
+    """
+    for table in ["activities", "tasks", "time_entries"]:
+        connection.exec_driver_sql(
+            "ALTER TABLE {} ADD COLUMN version INTEGER NOT NULL DEFAULT 1".format(table))
+
+    metadata = MetaData()
+    time_entries = Table("time_entries", metadata, autoload_with=connection)
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_time_entries_running")
+    Index(
+        "ix_time_entries_running",
+        time_entries.c.task_id,
+        time_entries.c.end_time,
+        sqlite_where=text("end_time IS NULL"),
+        postgresql_where=text("end_time IS NULL")
+    ).create(bind=connection)
+
+
+@migration(5)
+def add_name_search(connection):
+    """
+    FTS5 indexes over activity and task names, filled from the existing rows.
+    SQLite only.
+    """
+    if connection.dialect.name != "sqlite":
+        return
+    # The DDL of database.get_search_ddl as it was when this migration was
+    # written.
+    insert = "INSERT INTO {index} (rowid, name) VALUES (new.{key}, new.name);"
+    delete = ("INSERT INTO {index} ({index}, rowid, name) "
+              "VALUES ('delete', old.{key}, old.name);")
+    statements = [
+        "CREATE VIRTUAL TABLE {index} USING fts5("
+        "name, content='{table}', content_rowid='{key}', prefix='2 3')",
+        "CREATE TRIGGER {index}_insert AFTER INSERT ON {table} BEGIN " + insert + " END",
+        "CREATE TRIGGER {index}_delete AFTER DELETE ON {table} BEGIN " + delete + " END",
+        "CREATE TRIGGER {index}_update AFTER UPDATE OF name ON {table} BEGIN "
+        + delete + " " + insert + " END",
+    ]
+    for table, key in [("activities", "activity_id"), ("tasks", "task_id")]:
+        for statement in statements:
+            connection.exec_driver_sql(
+                statement.format(index="{}_fts".format(table), table=table, key=key))
+        connection.exec_driver_sql(
+            "INSERT INTO {0}_fts ({0}_fts) VALUES ('rebuild')".format(table))
+
+
+@migration(6)
+def add_single_running_entry(connection):
+    """
+    Make the running entries index unique on task_id. Tasks that already have
+    several running entries keep the latest one; the others are stopped with
+    a zero duration, so task and activity totals are unchanged.
+    """
+    connection.exec_driver_sql(
+        "UPDATE time_entries SET end_time = start_time, duration = 0, version = version + 1 "
+        "WHERE end_time IS NULL AND time_entry_id NOT IN ("
+        "SELECT max(time_entry_id) FROM time_entries WHERE end_time IS NULL GROUP BY task_id)")
+
+    metadata = MetaData()
+    time_entries = Table("time_entries", metadata, autoload_with=connection)
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_time_entries_running")
+    Index(
+        "ix_time_entries_running",
+        time_entries.c.task_id,
+        unique=True,
+        sqlite_where=text("end_time IS NULL"),
+        postgresql_where=text("end_time IS NULL")
+    ).create(bind=connection)
+
+
+def get_latest_version():
+    return max(version for version, _ in MIGRATIONS)
+
+
+def get_schema_version(connection):
+    """
+    Return the applied schema version, or 0 for an unmanaged database.
+    """
+    if not inspect(connection).has_table(schema_version.name):
+        return 0
+    version = connection.execute(select(schema_version.c.version)).scalar()
+    return version or 0
+
+
+def migrate(engine):
+    """
+    Apply pending migrations, each in its own transaction. Returns the list
+    of versions applied.
+    """
+    with engine.begin() as connection:
+        schema_version.create(bind=connection, checkfirst=True)
+        current = get_schema_version(connection)
+        if connection.execute(select(schema_version.c.version)).first() is None:
+            connection.execute(schema_version.insert().values(version=current))
+
+    applied = []
+    for version, upgrade in sorted(MIGRATIONS, key=lambda item: item[0]):
+        if version <= current:
+            continue
+        with engine.begin() as connection:
+            upgrade(connection)
+            connection.execute(schema_version.update().values(version=version))
+        applied.append(version)
+    return applied
+
+
+def check_schema_version(engine):
+    """
+    Raise if the database is not at the latest schema version.
+    """
+    with engine.connect() as connection:
+        current = get_schema_version(connection)
+    latest = get_latest_version()
+    if current != latest:
+        raise RuntimeError(
+            "Database schema is at version {}, expected {}. "
+            "Run `python manage.py migrate`.".format(current, latest))
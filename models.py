@@ -1,6 +1,7 @@
-from datetime import datetime
+from datetime import date, datetime
+from enum import Enum
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 
 # Pydantic models for API input/output
 
@@ -41,7 +42,8 @@ class ActivityCreate(BaseModel):
 class ActivityUpdate(BaseModel):
     name: str
     original_estimate: float
-    completed_hours: float
+    # Ignored: completed hours are derived from the time entries.
+    completed_hours: Optional[float] = None
     finalized: bool
     price_per_hour: float
     money_received: bool
@@ -60,3 +62,71 @@ class TimeEntryCreate(BaseModel):
     task_id: int
     start_time: datetime
     end_time: datetime
+
+
+class ReportBucket(str, Enum):
+    day = "day"
+    week = "week"
+    month = "month"
+
+
+class ReportRow(BaseModel):
+    activity_id: int
+    name: str
+    period: date
+    hours: float
+    billable_amount: float
+    paid_amount: float
+    unpaid_amount: float
+
+
+class ImportRowError(BaseModel):
+    line: int
+    message: str
+
+
+class ImportResult(BaseModel):
+    imported: int = 0
+    skipped: int = 0
+    errors: List[ImportRowError] = []
+    # Last line read; False complete means the rows after it were not.
+    complete: bool = True
+    line: int = 0
+
+
+class BatchOp(str, Enum):
+    create = "create"
+    update = "update"
+    delete = "delete"
+
+
+class BatchResource(str, Enum):
+    activity = "activity"
+    task = "task"
+    time_entry = "time_entry"
+
+
+class BatchOperation(BaseModel):
+    op: BatchOp
+    resource: BatchResource
+    id: Optional[int]
+    data: Optional[dict]
+
+
+class BatchResult(BaseModel):
+    status_code: int
+    data: Optional[dict]
+
+
+class SearchType(str, Enum):
+    activity = "activity"
+    task = "task"
+
+
+class SearchResult(BaseModel):
+    type: SearchType
+    id: int
+    name: str
+    # None for tasks whose activity was deleted.
+    activity_id: Optional[int]
+    rank: float
@@ -0,0 +1,70 @@
+from sqlalchemy import Date, case, cast, func
+
+from database import Activity, DailyRollup, get_round
+from models import ReportBucket, ReportRow
+
+
+def get_bucket_expression(column, bucket, dialect="sqlite"):
+    """
+    SQL expression for the first day of the bucket a datetime falls in.
+    Weeks start on Monday.
+    """
+    if dialect != "sqlite":
+        if bucket == ReportBucket.day:
+            return cast(column, Date)
+        return cast(func.date_trunc(bucket.value, column), Date)
+    if bucket == ReportBucket.day:
+        return func.date(column)
+    if bucket == ReportBucket.week:
+        return func.date(column, "weekday 0", "-6 days")
+    return func.date(column, "start of month")
+
+
+def get_report(db, bucket, start=None, end=None, activity_id=None):
+    """
+    Hours and amounts per activity and period, computed with one GROUP BY
+    over the daily rollups.
+
+    Only stopped time entries are counted, split at midnight. start and end
+    are inclusive dates. An activity's amounts count as paid when its
+    money_received flag is set.
+    """
+    period = get_bucket_expression(DailyRollup.date, bucket, db.get_bind().dialect.name)
+    hours = func.sum(DailyRollup.seconds) / 3600.0
+    billable_amount = hours * func.coalesce(Activity.price_per_hour, 0)
+    paid = func.coalesce(Activity.money_received, False) == True
+
+    query = (
+        db.query(
+            Activity.activity_id,
+            Activity.name,
+            period.label("period"),
+            hours.label("hours"),
+            billable_amount.label("billable_amount"),
+            case((paid, billable_amount), else_=0).label("paid_amount"),
+            case((paid, 0), else_=billable_amount).label("unpaid_amount")
+        )
+        .join(DailyRollup, DailyRollup.activity_id == Activity.activity_id)
+        .group_by(Activity.activity_id, Activity.name, Activity.price_per_hour,
+                  Activity.money_received, period)
+        .order_by(period, Activity.activity_id)
+    )
+    if start is not None:
+        query = query.filter(DailyRollup.date >= start)
+    if end is not None:
+        query = query.filter(DailyRollup.date <= end)
+    if activity_id is not None:
+        query = query.filter(Activity.activity_id == activity_id)
+
+    return [
+        ReportRow(
+            activity_id=row.activity_id,
+            name=row.name,
+            period=row.period,
+            hours=get_round(row.hours),
+            billable_amount=get_round(row.billable_amount),
+            paid_amount=get_round(row.paid_amount),
+            unpaid_amount=get_round(row.unpaid_amount)
+        )
+        for row in query
+    ]
@@ -0,0 +1,232 @@
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+from database import Activity, DailyRollup, Task, TimeEntry
+
+# Task.duration is kept in minutes and Activity.completed_hours /
+# remaining_hours in hours, both derived from TimeEntry.duration (seconds).
+
+
+def lock_activity(db, activity_id):
+    """
+    Lock an activity's row until the end of the transaction.
+
+    Writers that add deltas to an activity's totals and refresh_activity,
+    which recomputes them from the time entries, take this lock first so
+    they run one after the other: otherwise, under READ COMMITTED, a refresh
+    could overwrite the totals with sums that miss a concurrent delta.
+    SQLite already serializes writers, and SELECT ... FOR UPDATE does not
+    exist there, so nothing is sent.
+    """
+    if activity_id is None or db.get_bind().dialect.name == "sqlite":
+        return
+    db.execute(select(Activity.activity_id)
+               .where(Activity.activity_id == activity_id).with_for_update())
+
+
+def apply_time_entry_delta(db, task_id, seconds):
+    """
+    Add the duration of a stopped time entry to its task and activity.
+
+    Runs as two atomic UPDATE statements on the caller's session, so the
+    cost does not depend on how many entries the task already has. The
+    caller owns the transaction and commits it.
+    """
+    minutes = seconds / 60
+    hours = seconds / 3600
+
+    db.execute(
+        update(Task)
+        .where(Task.task_id == task_id)
+        .values(duration=func.coalesce(Task.duration, 0) + minutes,
+                version=Task.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+    activity_id = select(Task.activity_id).where(
+        Task.task_id == task_id).scalar_subquery()
+    apply_activity_delta(db, activity_id, hours)
+
+
+def apply_activity_delta(db, activity_id, hours):
+    """
+    Add hours to an activity's completed hours and take them off the
+    remaining hours, in one atomic UPDATE on the caller's session.
+    """
+    db.execute(
+        update(Activity)
+        .where(Activity.activity_id == activity_id)
+        .values(
+            completed_hours=func.coalesce(Activity.completed_hours, 0) + hours,
+            remaining_hours=func.coalesce(Activity.remaining_hours, 0) - hours,
+            version=Activity.version + 1
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def detach_tasks(db, activity_id):
+    """
+    Unlink the tasks and daily rollups of an activity about to be deleted,
+    with one UPDATE per table instead of one per task.
+    """
+    db.execute(
+        update(Task)
+        .where(Task.activity_id == activity_id)
+        .values(activity_id=None, version=Task.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(
+        update(DailyRollup)
+        .where(DailyRollup.activity_id == activity_id)
+        .values(activity_id=None)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def reconcile(db, activity_ids=None):
+    """
+    Recompute task durations and activity hours from the time entries.
+
+    Fixes any drift left by the incremental updates. Each table is rewritten
+    with a single aggregate UPDATE; pass activity_ids to limit the work to
+    some activities. The caller commits.
+    """
+    entry_seconds = select(func.coalesce(func.sum(TimeEntry.duration), 0)).where(
+        TimeEntry.task_id == Task.task_id).scalar_subquery()
+    tasks = update(Task).values(duration=entry_seconds / 60.0, version=Task.version + 1)
+    if activity_ids is not None:
+        tasks = tasks.where(Task.activity_id.in_(activity_ids))
+    db.execute(tasks.execution_options(synchronize_session=False))
+
+    task_minutes = select(func.coalesce(func.sum(Task.duration), 0)).where(
+        Task.activity_id == Activity.activity_id).scalar_subquery()
+    activities = update(Activity).values(
+        completed_hours=task_minutes / 60.0,
+        remaining_hours=func.coalesce(
+            Activity.original_estimate, 0) - task_minutes / 60.0,
+        version=Activity.version + 1
+    )
+    if activity_ids is not None:
+        activities = activities.where(Activity.activity_id.in_(activity_ids))
+    db.execute(activities.execution_options(synchronize_session=False))
+
+
+def split_by_day(start_time, end_time):
+    """
+    Yield (date, seconds) for each calendar day the interval touches.
+    """
+    if start_time.date() == end_time.date():
+        if start_time < end_time:
+            yield start_time.date(), (end_time - start_time).total_seconds()
+        return
+
+    while start_time < end_time:
+        midnight = datetime.combine(start_time.date() + timedelta(days=1), time.min)
+        day_end = min(midnight, end_time)
+        yield start_time.date(), (day_end - start_time).total_seconds()
+        start_time = day_end
+
+
+def upsert_daily_rollups(db, rows):
+    """
+    Add seconds to daily_rollups rows, creating the missing ones.
+
+    rows are dicts with task_id, activity_id, date and seconds. On SQLite the
+    statement goes straight to the driver, which matters for large imports.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        db.connection().exec_driver_sql(
+            "INSERT INTO daily_rollups (task_id, date, activity_id, seconds) "
+            "VALUES (?, ?, ?, ?) ON CONFLICT (task_id, date) "
+            "DO UPDATE SET seconds = seconds + excluded.seconds",
+            [(row["task_id"], row["date"].isoformat(), row["activity_id"], row["seconds"])
+             for row in rows]
+        )
+        return
+
+    statement = postgresql.insert(DailyRollup.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=["task_id", "date"],
+        set_={"seconds": DailyRollup.__table__.c.seconds + statement.excluded.seconds}
+    )
+    db.execute(statement, rows)
+
+
+def add_to_daily_rollups(db, task_id, activity_id, start_time, end_time):
+    """
+    Add a stopped time entry to the daily rollups of its task, split at
+    midnight. The caller commits.
+    """
+    rows = [
+        {"task_id": task_id, "activity_id": activity_id,
+         "date": date, "seconds": seconds}
+        for date, seconds in split_by_day(start_time, end_time)
+    ]
+    if rows:
+        upsert_daily_rollups(db, rows)
+
+
+def rebuild_daily_rollups(db, task_ids=None, batch_size=10000):
+    """
+    Regenerate daily_rollups from the stopped time entries.
+
+    Entries are streamed from the database and the per-day totals written
+    with bulk inserts. Only Core statements are used, so db may be a Session
+    or a Connection. Pass task_ids to rebuild only some tasks. The caller
+    commits.
+    """
+    daily_rollups = DailyRollup.__table__
+
+    statement = delete(daily_rollups)
+    if task_ids is not None:
+        statement = statement.where(daily_rollups.c.task_id.in_(task_ids))
+    db.execute(statement)
+
+    entries = (
+        select(TimeEntry.task_id, Task.activity_id,
+               TimeEntry.start_time, TimeEntry.end_time)
+        .join(Task, Task.task_id == TimeEntry.task_id)
+        .where(TimeEntry.end_time != None)
+        .execution_options(stream_results=True)
+    )
+    if task_ids is not None:
+        entries = entries.where(TimeEntry.task_id.in_(task_ids))
+
+    totals = {}
+    for task_id, activity_id, start_time, end_time in db.execute(entries):
+        for date, seconds in split_by_day(start_time, end_time):
+            key = (task_id, date)
+            if key in totals:
+                totals[key][1] += seconds
+            else:
+                totals[key] = [activity_id, seconds]
+
+    rows = [
+        {"task_id": task_id, "date": date,
+         "activity_id": activity_id, "seconds": seconds}
+        for (task_id, date), (activity_id, seconds) in totals.items()
+    ]
+    for index in range(0, len(rows), batch_size):
+        db.execute(daily_rollups.insert(), rows[index:index + batch_size])
+
+
+def refresh_activity(bind, activity_id, task_ids=()):
+    """
+    Recompute an activity's hours and its tasks' durations, and rebuild the
+    daily rollups of task_ids, in a transaction of its own. Run in the
+    background for batches and imports, see main.schedule_refresh.
+    """
+    db = Session(bind=bind)
+    try:
+        lock_activity(db, activity_id)
+        if task_ids:
+            rebuild_daily_rollups(db, list(task_ids))
+        reconcile(db, [activity_id])
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,97 @@
+import re
+
+from sqlalchemy import func, text
+
+from database import Activity, Task
+from models import SearchResult, SearchType
+
+# Ranked prefix search over activity and task names.
+#
+# On SQLite the FTS5 indexes created by get_search_ddl() are queried, ranked
+# by bm25 (lower is better). Other databases fall back to a case-insensitive
+# prefix match on the name, ranked by name length.
+
+TERM = re.compile(r"\w+", re.UNICODE)
+
+# The best matches are picked inside the FTS table, using its rank column
+# (bm25 by default), before joining to the rows.
+QUERIES = {
+    SearchType.activity: (
+        "SELECT activities.activity_id AS id, activities.name, "
+        "activities.activity_id, matches.rank "
+        "FROM (SELECT rowid, rank FROM activities_fts WHERE activities_fts MATCH :match "
+        "ORDER BY rank LIMIT :limit) AS matches "
+        "JOIN activities ON activities.activity_id = matches.rowid ORDER BY matches.rank"
+    ),
+    SearchType.task: (
+        "SELECT tasks.task_id AS id, tasks.name, tasks.activity_id, matches.rank "
+        "FROM (SELECT rowid, rank FROM tasks_fts WHERE tasks_fts MATCH :match "
+        "ORDER BY rank LIMIT :limit) AS matches "
+        "JOIN tasks ON tasks.task_id = matches.rowid ORDER BY matches.rank"
+    ),
+}
+
+
+def get_match_expression(query):
+    """
+    FTS5 query matching names with a word starting with each word of query.
+    Words are quoted, so FTS5 operators in the input are searched for
+    literally.
+    """
+    terms = TERM.findall(query)
+    if not terms:
+        return None
+    return " ".join('"{}"*'.format(term) for term in terms)
+
+
+def search_names(db, query, limit=20, type=None):
+    """
+    Return up to limit activities and tasks whose names match query, best
+    first.
+    """
+    types = [type] if type is not None else list(SearchType)
+    if db.get_bind().dialect.name != "sqlite":
+        return search_names_by_prefix(db, query, limit, types)
+
+    match = get_match_expression(query)
+    if match is None:
+        return []
+
+    results = []
+    for search_type in types:
+        rows = db.execute(text(QUERIES[search_type]), {"match": match, "limit": limit})
+        results.extend(
+            SearchResult(type=search_type, id=row.id, name=row.name,
+                         activity_id=row.activity_id, rank=row.rank)
+            for row in rows
+        )
+    results.sort(key=lambda result: result.rank)
+    return results[:limit]
+
+
+def search_names_by_prefix(db, query, limit, types):
+    query = query.strip()
+    if not query:
+        return []
+
+    results = []
+    if SearchType.activity in types:
+        rows = (db.query(Activity.activity_id, Activity.name)
+                .filter(func.lower(Activity.name).startswith(query.lower(), autoescape=True))
+                .order_by(Activity.name).limit(limit))
+        results.extend(
+            SearchResult(type=SearchType.activity, id=activity_id, name=name,
+                         activity_id=activity_id, rank=len(name))
+            for activity_id, name in rows
+        )
+    if SearchType.task in types:
+        rows = (db.query(Task.task_id, Task.name, Task.activity_id)
+                .filter(func.lower(Task.name).startswith(query.lower(), autoescape=True))
+                .order_by(Task.name).limit(limit))
+        results.extend(
+            SearchResult(type=SearchType.task, id=task_id, name=name,
+                         activity_id=activity_id, rank=len(name))
+            for task_id, name, activity_id in rows
+        )
+    results.sort(key=lambda result: result.rank)
+    return results[:limit]
@@ -0,0 +1,58 @@
+from pydantic import BaseSettings
+
+
+class Settings(BaseSettings):
+    """
+    Application settings, read from TIME_TRACKER_* environment variables.
+    """
+    database_url: str = "sqlite:///time_tracker.db"
+
+    # Serve read endpoints straight from the rows with orjson, skipping the
+    # Pydantic response models.
+    fast_json: bool = False
+
+    # Read cache of the get and list endpoints: at most cache_size entries,
+    # each kept for cache_ttl seconds. 0 disables it. With several workers
+    # it is disabled unless cache_size is set explicitly.
+    cache_size: int = 1024
+    cache_ttl: float = 60
+
+    # Background jobs (recomputing totals after batches and imports) run on
+    # job_workers threads, job_delay seconds after they are queued so that
+    # changes to the same activity are recomputed once. 0 workers runs them
+    # inline.
+    job_workers: int = 2
+    job_delay: float = 0.5
+
+    # Application logs go to stderr as JSON lines ("json") or plain text
+    # ("text"). Requests slower than slow_request_seconds are logged as
+    # warnings; every request is logged at DEBUG.
+    log_level: str = "INFO"
+    log_format: str = "json"
+    slow_request_seconds: float = 1.0
+
+    # Server started by `python main.py` or gunicorn.conf.py. Each worker is
+    # a separate process with its own connection pool, read cache, event
+    # broker and metrics.
+    host: str = "127.0.0.1"
+    port: int = 5001
+    workers: int = 1
+
+    # Flutter web build served at "/" when it exists.
+    static_directory: str = "ui/time_tracker_ui/build/web"
+
+    # Connection pool: at most pool_size + max_overflow connections are
+    # open at once; further requests wait up to pool_timeout seconds.
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30
+
+    # "production" switches SQLite to WAL with synchronous=NORMAL and applies
+    # the sqlite_* values below on every new connection.
+    sqlite_profile: str = "default"
+    sqlite_busy_timeout: int = 5000
+    sqlite_cache_size: int = -64000
+    sqlite_mmap_size: int = 268435456
+
+    class Config:
+        env_prefix = "TIME_TRACKER_"
@@ -1 +1 @@
-C:\Projects\TimeTrackerApp\.env\Scripts\activate && python .\main.py
\ No newline at end of file
+C:\Projects\TimeTrackerApp\.env\Scripts\activate && python .\manage.py migrate && python .\main.py
\ No newline at end of file
@@ -0,0 +1,72 @@
+from sqlalchemy.orm import Session
+
+from database import Base, Task, TimeEntry, create_db_engine
+from settings import Settings
+
+
+def test_engine_pool_is_bounded(tmp_path):
+    settings = Settings(
+        database_url="sqlite:///{}".format(tmp_path / "pool.db"),
+        pool_size=2,
+        max_overflow=1,
+        pool_timeout=5
+    )
+    engine = create_db_engine(settings)
+    assert engine.pool.size() == 2
+    assert engine.pool._max_overflow == 1
+    assert engine.pool._timeout == 5
+    engine.dispose()
+
+
+def test_sqlite_production_profile(tmp_path):
+    settings = Settings(
+        database_url="sqlite:///{}".format(tmp_path / "profile.db"),
+        sqlite_profile="production",
+        sqlite_busy_timeout=1234
+    )
+    engine = create_db_engine(settings)
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+        # NORMAL
+        assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 1234
+        assert connection.exec_driver_sql("PRAGMA cache_size").scalar() == -64000
+    engine.dispose()
+
+
+def test_sqlite_default_profile(tmp_path):
+    settings = Settings(database_url="sqlite:///{}".format(tmp_path / "default.db"))
+    engine = create_db_engine(settings)
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "delete"
+    engine.dispose()
+
+
+def get_query_plan(engine, query):
+    statement = query.statement.compile(
+        engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(
+            "EXPLAIN QUERY PLAN {}".format(statement)).fetchall()
+    return " ".join(row[-1] for row in rows)
+
+
+def test_lookups_use_indexes(tmp_path):
+    engine = create_db_engine(
+        Settings(database_url="sqlite:///{}".format(tmp_path / "plan.db")))
+    Base.metadata.create_all(bind=engine)
+    db = Session(bind=engine)
+
+    plan = get_query_plan(engine, db.query(Task).filter(Task.activity_id == 1))
+    assert "ix_tasks_activity_id" in plan
+
+    plan = get_query_plan(engine, db.query(TimeEntry).filter(TimeEntry.task_id == 1))
+    assert "ix_time_entries_task_id" in plan
+
+    plan = get_query_plan(engine, db.query(TimeEntry).filter(
+        TimeEntry.task_id == 1, TimeEntry.end_time == None))
+    assert "ix_time_entries_running" in plan
+
+    db.close()
+    engine.dispose()
+
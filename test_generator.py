@@ -0,0 +1,58 @@
+from database import create_db_engine
+from generator import generate
+from migrations import migrate
+from rollups import rebuild_daily_rollups, reconcile
+from settings import Settings
+
+QUERIES = {
+    "activities": "SELECT activity_id, finalized, round(completed_hours, 6) FROM activities ORDER BY 1",
+    "tasks": "SELECT task_id, activity_id, closed, round(duration, 6) FROM tasks ORDER BY 1",
+    "time_entries": "SELECT task_id, start_time, end_time FROM time_entries ORDER BY 1, 2",
+    "daily_rollups": "SELECT task_id, date, round(seconds, 6) FROM daily_rollups ORDER BY 1, 2",
+}
+
+
+def get_engine(path):
+    return create_db_engine(Settings(database_url="sqlite:///{}".format(path)))
+
+
+def dump(engine):
+    with engine.connect() as connection:
+        return {table: [tuple(row) for row in connection.exec_driver_sql(query)]
+                for table, query in QUERIES.items()}
+
+
+def generate_dump(path, **options):
+    engine = get_engine(path)
+    migrate(engine)
+    with engine.begin() as connection:
+        written = generate(connection, 5, 40, 2000, batch_size=500, **options)
+    rows = dump(engine)
+    engine.dispose()
+    return written, rows
+
+
+def test_generate_is_deterministic_and_consistent(tmp_path):
+    options = {"seed": 7, "distribution": "skewed", "open_fraction": 0.5,
+               "finalized_fraction": 0.4}
+    written, rows = generate_dump(tmp_path / "first.db", **options)
+    assert generate_dump(tmp_path / "second.db", **options) == (written, rows)
+    assert generate_dump(tmp_path / "other.db", seed=8)[1] != rows
+
+    assert written["activities"] == len(rows["activities"]) == 5
+    assert written["tasks"] == len(rows["tasks"]) == 40
+    assert written["time_entries"] == len(rows["time_entries"])
+    running = [task_id for task_id, _, end_time in rows["time_entries"] if end_time is None]
+    assert len(running) == written["time_entries"] - 2000
+    assert len(set(running)) == len(running)
+    finalized = {activity_id for activity_id, is_finalized, _ in rows["activities"] if is_finalized}
+    assert all(closed for _, activity_id, closed, _ in rows["tasks"] if activity_id in finalized)
+
+    # Totals and rollups written by the generator match the ones derived from
+    # the time entries.
+    engine = get_engine(tmp_path / "first.db")
+    with engine.begin() as connection:
+        reconcile(connection)
+        rebuild_daily_rollups(connection)
+    assert dump(engine) == rows
+    engine.dispose()
@@ -1,12 +1,30 @@
+import asyncio
+import codecs
+import json
+import logging
 import pytest
 import random
 import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from inspect import iscoroutinefunction
+from datetime import date, datetime, timedelta
+from fastapi.routing import APIRoute
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
-from database import Base
-from main import app, get_db
+from bulk import import_time_entries
+from cache import ReadCache
+from database import Activity, Base, DailyRollup, Task, TimeEntry, create_db_engine
+from events import stream_events
+from jobs import JobQueue
+from main import app, create_app, get_db
+from logs import JsonFormatter
+from migrations import migrate
+from rollups import rebuild_daily_rollups, reconcile, split_by_day
+from settings import Settings
 
 SQLALCHEMY_DATABASE_URL = "sqlite+pysqlite:///:memory:", 
 
@@ -30,6 +48,8 @@ def override_get_db():
 
 
 app.dependency_overrides[get_db] = override_get_db
+# Run background jobs inline, so tests see their results right away.
+app.state.jobs = JobQueue(workers=0)
 
 client = TestClient(app)
 
@@ -63,13 +83,31 @@ def test_update_activity(test_data):
     activity_data, _, _ = test_data
     response = client.post("/api/activities/", json=activity_data)
     activity_id = response.json()["activity_id"]
-    update_data = {"name": "Updated Activity", "original_estimate": 20.0, "remaining_hours": 10.0, "completed_hours": 5.0}
+    update_data = {"name": "Updated Activity", "original_estimate": 20.0, "finalized": False,
+                   "price_per_hour": 0.0, "money_received": False}
     response = client.put(f"/api/activities/{activity_id}/", json=update_data)
     assert response.status_code == 200
     assert response.json()["name"] == update_data["name"]
     assert response.json()["original_estimate"] == update_data["original_estimate"]
-    assert response.json()["remaining_hours"] == update_data["remaining_hours"]
-    assert response.json()["completed_hours"] == update_data["completed_hours"]
+    # Hours are derived from the time entries, not taken from the client.
+    assert response.json()["remaining_hours"] == 20.0
+    assert response.json()["completed_hours"] == 0.0
+
+def test_update_activity_keeps_tracked_hours(test_data):
+    activity_data, task_data, _ = test_data
+    activity = client.post("/api/activities/", json=activity_data).json()
+    task_data["activity_id"] = activity["activity_id"]
+    task_id = client.post("/api/tasks/", json=task_data).json()["task_id"]
+    time_entry_id = client.post(f"/api/time_entries/{task_id}/start").json()["time_entry_id"]
+    client.put(f"/api/time_entries/{time_entry_id}/stop")
+    completed_hours = client.get(f"/api/activities/{activity['activity_id']}/").json()["completed_hours"]
+
+    update_data = {"name": activity["name"], "original_estimate": 20.0, "completed_hours": 0.0,
+                   "finalized": False, "price_per_hour": 0.0, "money_received": False}
+    response = client.put(f"/api/activities/{activity['activity_id']}/", json=update_data)
+    assert response.status_code == 200
+    assert response.json()["completed_hours"] == completed_hours
+    assert response.json()["remaining_hours"] == pytest.approx(20.0 - completed_hours)
 
 def test_delete_activity(test_data):
     activity_data, _, _ = test_data
@@ -208,6 +246,832 @@ def test_get_time_entry_no_end_time(test_data):
     assert response.status_code == 404
     assert response.json()["detail"] == "No time entry without end time"
 
+def test_stop_time_entry_updates_rollups():
+    response = client.post("/api/activities/", json={"name": "Rollup", "original_estimate": 10.0})
+    activity_id = response.json()["activity_id"]
+    response = client.post("/api/tasks/", json={"activity_id": activity_id, "name": "Rollup task"})
+    task_id = response.json()["task_id"]
+
+    response = client.post(f"/api/time_entries/{task_id}/start")
+    time_entry_id = response.json()["time_entry_id"]
+
+    db = TestingSessionLocal()
+    db.query(TimeEntry).get(time_entry_id).start_time -= timedelta(hours=2)
+    db.commit()
+    db.close()
+
+    response = client.put(f"/api/time_entries/{time_entry_id}/stop")
+    assert response.status_code == 200
+
+    response = client.get(f"/api/tasks/{task_id}/")
+    assert response.json()["duration"] == pytest.approx(120, abs=0.1)
+    response = client.get(f"/api/activities/{activity_id}/")
+    assert response.json()["completed_hours"] == pytest.approx(2, abs=0.01)
+    assert response.json()["remaining_hours"] == pytest.approx(8, abs=0.01)
+
+def test_concurrent_start_and_stop_keep_one_running_entry(tmp_path):
+    settings = Settings(database_url="sqlite:///{}".format(tmp_path / "race.db"),
+                        sqlite_profile="production", static_directory=str(tmp_path / "missing"),
+                        log_format="text")
+    migrate_engine = create_db_engine(settings)
+    migrate(migrate_engine)
+    migrate_engine.dispose()
+
+    with TestClient(create_app(settings)) as app_client, ThreadPoolExecutor(8) as executor:
+        activity_id = app_client.post(
+            "/api/activities/", json={"name": "Race", "original_estimate": 1.0}).json()["activity_id"]
+        task_id = app_client.post(
+            "/api/tasks/", json={"activity_id": activity_id, "name": "Race"}).json()["task_id"]
+
+        for _ in range(10):
+            responses = list(executor.map(
+                lambda _: app_client.post(f"/api/time_entries/{task_id}/start"), range(8)))
+            assert sorted(response.status_code for response in responses) == [200] + [409] * 7
+            time_entry_id = next(response.json()["time_entry_id"]
+                                 for response in responses if response.status_code == 200)
+            assert app_client.get(f"/api/time_entries/task/{task_id}/playing").json()[
+                "time_entry_id"] == time_entry_id
+
+            responses = list(executor.map(
+                lambda _: app_client.put(f"/api/time_entries/{time_entry_id}/stop"), range(8)))
+            assert {response.status_code for response in responses} == {200}
+            assert len({response.json()["end_time"] for response in responses}) == 1
+
+        entries = app_client.get(f"/api/time_entries/task/{task_id}/").json()
+
+    assert len(entries) == 10
+    assert all(entry["end_time"] is not None for entry in entries)
+    # Each entry's duration was applied once.
+    engine = create_db_engine(settings)
+    with engine.connect() as connection:
+        seconds = connection.exec_driver_sql("SELECT sum(duration) FROM time_entries").scalar()
+        minutes = connection.exec_driver_sql("SELECT duration FROM tasks").scalar()
+        rollup_seconds = connection.exec_driver_sql("SELECT sum(seconds) FROM daily_rollups").scalar()
+    engine.dispose()
+    assert minutes * 60 == pytest.approx(seconds)
+    assert rollup_seconds == pytest.approx(seconds)
+
+def test_reconcile_fixes_drift():
+    response = client.post("/api/activities/", json={"name": "Drift", "original_estimate": 5.0})
+    activity_id = response.json()["activity_id"]
+    response = client.post("/api/tasks/", json={"activity_id": activity_id, "name": "Drift task"})
+    task_id = response.json()["task_id"]
+
+    db = TestingSessionLocal()
+    start_time = datetime(2023, 1, 1, 10, 0)
+    db.add(TimeEntry(task_id=task_id, start_time=start_time,
+                     end_time=start_time + timedelta(minutes=90), duration=5400.0))
+    db.query(Task).get(task_id).duration = 999.0
+    db.commit()
+
+    reconcile(db, [activity_id])
+    db.commit()
+
+    assert db.query(Task).get(task_id).duration == 90
+    activity = db.query(Activity).get(activity_id)
+    assert activity.completed_hours == 1.5
+    assert activity.remaining_hours == 3.5
+    db.close()
+
+def count_commits(request):
+    commits = []
+    listener = lambda conn: commits.append(conn)
+    event.listen(engine, "commit", listener)
+    try:
+        response = request()
+    finally:
+        event.remove(engine, "commit", listener)
+    return response, len(commits)
+
+def test_time_entry_write_path_commits_once():
+    response = client.post("/api/activities/", json={"name": "Commits", "original_estimate": 1.0})
+    activity_id = response.json()["activity_id"]
+    response = client.post("/api/tasks/", json={"activity_id": activity_id, "name": "Commits task"})
+    task_id = response.json()["task_id"]
+
+    response, commits = count_commits(lambda: client.post(f"/api/time_entries/{task_id}/start"))
+    assert response.status_code == 200
+    assert commits == 1
+    time_entry_id = response.json()["time_entry_id"]
+
+    response, commits = count_commits(lambda: client.put(f"/api/time_entries/{time_entry_id}/stop"))
+    assert response.status_code == 200
+    assert commits == 1
+
+    response, commits = count_commits(lambda: client.delete(f"/api/tasks/{task_id}/"))
+    assert response.status_code == 200
+    assert commits == 1
+
+    response = client.get(f"/api/time_entries/{time_entry_id}/")
+    assert response.status_code == 404
+
+def test_database_handlers_do_not_block_event_loop():
+    for route in app.routes:
+        if isinstance(route, APIRoute) and any(
+                dependency.call is get_db for dependency in route.dependant.dependencies):
+            assert not iscoroutinefunction(route.endpoint), route.path
+
+def test_create_app_sets_up_database_on_startup(tmp_path):
+    settings = Settings(database_url="sqlite:///{}".format(tmp_path / "app.db"),
+                        static_directory=str(tmp_path / "missing"))
+    application = create_app(settings)
+    assert not hasattr(application.state, "engine")
+    assert not (tmp_path / "app.db").exists()
+
+    migrate_engine = create_db_engine(settings)
+    migrate(migrate_engine)
+    migrate_engine.dispose()
+
+    with TestClient(application) as app_client:
+        response = app_client.post("/api/activities/", json={"name": "Factory", "original_estimate": 1.0})
+        assert response.status_code == 201
+        response = app_client.get("/api/activities/")
+        assert [activity["name"] for activity in response.json()] == ["Factory"]
+
+def test_create_app_refuses_unmigrated_database(tmp_path):
+    settings = Settings(database_url="sqlite:///{}".format(tmp_path / "empty.db"))
+    with pytest.raises(RuntimeError, match="manage.py migrate"):
+        with TestClient(create_app(settings)):
+            pass
+
+def test_json_responses_declare_utf8_charset():
+    response = client.post("/api/activities/", json={"name": "Atividade é", "original_estimate": 1.0})
+    assert response.headers["content-type"] == "application/json; charset=utf-8"
+    response = client.get("/api/activities/", params={"name": "Atividade é"})
+    assert response.headers["content-type"] == "application/json; charset=utf-8"
+    assert response.json()[0]["name"] == "Atividade é"
+
+def test_fast_json_matches_response_models():
+    response = client.post("/api/activities/", json={"name": "Fast", "original_estimate": 3.0})
+    activity_id = response.json()["activity_id"]
+    response = client.post("/api/tasks/", json={"activity_id": activity_id, "name": "Fast task"})
+    task_id = response.json()["task_id"]
+    response = client.post(f"/api/time_entries/{task_id}/start")
+    client.put(f"/api/time_entries/{response.json()['time_entry_id']}/stop")
+    client.post(f"/api/time_entries/{task_id}/start")
+
+    urls = [
+        f"/api/activities/{activity_id}/",
+        "/api/activities/?name=Fast",
+        f"/api/tasks/{task_id}/",
+        f"/api/tasks/activity/{activity_id}/",
+        f"/api/time_entries/task/{task_id}/",
+        f"/api/time_entries/task/{task_id}/playing",
+    ]
+    expected = [client.get(url).json() for url in urls]
+
+    app.state.settings.fast_json = True
+    try:
+        responses = [client.get(url) for url in urls]
+    finally:
+        app.state.settings.fast_json = False
+
+    assert [response.json() for response in responses] == expected
+    assert responses[0].headers["content-type"] == "application/json; charset=utf-8"
+
+def test_list_time_entries_keyset_pagination():
+    response = client.post("/api/activities/", json={"name": "Pages", "original_estimate": 1.0})
+    activity_id = response.json()["activity_id"]
+    response = client.post("/api/tasks/", json={"activity_id": activity_id, "name": "Pages task"})
+    task_id = response.json()["task_id"]
+
+    db = TestingSessionLocal()
+    start_time = datetime(2023, 1, 1, 10, 0)
+    db.add_all([TimeEntry(task_id=task_id, start_time=start_time + timedelta(hours=i),
+                          end_time=start_time + timedelta(hours=i, minutes=30), duration=1800.0)
+                for i in range(5)])
+    db.commit()
+    db.close()
+
+    all_ids = [entry["time_entry_id"] for entry in client.get(f"/api/time_entries/task/{task_id}/").json()]
+    assert len(all_ids) == 5
+
+    ids = []
+    after = None
+    while True:
+        params = {"limit": 2}
+        if after is not None:
+            params["after"] = after
+        response = client.get(f"/api/time_entries/task/{task_id}/", params=params)
+        assert response.status_code == 200
+        ids += [entry["time_entry_id"] for entry in response.json()]
+        after = response.headers.get("X-Next-After")
+        if after is None:
+            break
+    assert ids == all_ids
+
+    response = client.get(f"/api/time_entries/task/{task_id}/", params={"limit": 0})
+    assert response.status_code == 422
+
+def test_stream_time_entries_ndjson():
+    response = client.post("/api/activities/", json={"name": "Stream", "original_estimate": 1.0})
+    activity_id = response.json()["activity_id"]
+    response = client.post("/api/tasks/", json={"activity_id": activity_id, "name": "Stream task"})
+    task_id = response.json()["task_id"]
+    client.post(f"/api/time_entries/{task_id}/start")
+
+    expected = client.get(f"/api/time_entries/task/{task_id}/").json()
+    response = client.get(f"/api/time_entries/task/{task_id}/stream")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == expected
+
+    response = client.get("/api/activities/stream", params={"name": "Stream"})
+    assert [json.loads(line)["activity_id"] for line in response.text.splitlines()] == [activity_id]
+
+def test_reports_group_by_activity_and_period():
+    response = client.post("/api/activities/", json={"name": "Report", "original_estimate": 10.0})
+    activity_id = response.json()["activity_id"]
+    response = client.post("/api/tasks/", json={"activity_id": activity_id, "name": "Report task"})
+    task_id = response.json()["task_id"]
+
+    db = TestingSessionLocal()
+    activity = db.query(Activity).get(activity_id)
+    activity.price_per_hour = 50.0
+    for start_time, hours in [(datetime(2023, 3, 6, 9), 2), (datetime(2023, 3, 6, 14), 1),
+                              (datetime(2023, 3, 8, 9), 1.5), (datetime(2023, 4, 3, 9), 4)]:
+        db.add(TimeEntry(task_id=task_id, start_time=start_time,
+                         end_time=start_time + timedelta(hours=hours), duration=hours * 3600))
+    db.add(TimeEntry(task_id=task_id, start_time=datetime(2023, 3, 7, 9)))
+    db.flush()
+    rebuild_daily_rollups(db, [task_id])
+    db.commit()
+    db.close()
+
+    response = client.get("/api/reports", params={"activity_id": activity_id, "bucket": "day"})
+    assert response.status_code == 200
+    assert [(row["period"], row["hours"], row["billable_amount"]) for row in response.json()] == [
+        ("2023-03-06", 3.0, 150.0), ("2023-03-08", 1.5, 75.0), ("2023-04-03", 4.0, 200.0)]
+    assert all(row["unpaid_amount"] == row["billable_amount"] for row in response.json())
+
+    response = client.get("/api/reports", params={"activity_id": activity_id, "bucket": "week",
+                                                  "start": "2023-03-01", "end": "2023-03-31"})
+    assert [(row["period"], row["hours"]) for row in response.json()] == [("2023-03-06", 4.5)]
+
+    db = TestingSessionLocal()
+    db.query(Activity).get(activity_id).money_received = True
+    db.commit()
+    db.close()
+
+    response = client.get("/api/reports", params={"activity_id": activity_id, "bucket": "month"})
+    assert [(row["period"], row["hours"], row["paid_amount"], row["unpaid_amount"])
+            for row in response.json()] == [("2023-03-01", 4.5, 225.0, 0.0), ("2023-04-01", 4.0, 200.0, 0.0)]
+
+    response = client.get("/api/reports", params={"bucket": "year"})
+    assert response.status_code == 422
+
+def test_split_by_day():
+    assert list(split_by_day(datetime(2023, 1, 1, 23, 0), datetime(2023, 1, 3, 1, 30))) == [
+        (date(2023, 1, 1), 3600.0), (date(2023, 1, 2), 86400.0), (date(2023, 1, 3), 5400.0)]
+    assert list(split_by_day(datetime(2023, 1, 1, 9, 0), datetime(2023, 1, 1, 9, 0))) == []
+
+def test_stop_time_entry_updates_daily_rollups():
+    response = client.post("/api/activities/", json={"name": "Daily", "original_estimate": 10.0})
+    activity_id = response.json()["activity_id"]
+    response = client.post("/api/tasks/", json={"activity_id": activity_id, "name": "Daily task"})
+    task_id = response.json()["task_id"]
+
+    for hours_ago in (30, 1):
+        response = client.post(f"/api/time_entries/{task_id}/start")
+        time_entry_id = response.json()["time_entry_id"]
+        db = TestingSessionLocal()
+        db.query(TimeEntry).get(time_entry_id).start_time -= timedelta(hours=hours_ago)
+        db.commit()
+        db.close()
+        client.put(f"/api/time_entries/{time_entry_id}/stop")
+
+    db = TestingSessionLocal()
+    stopped = {(row.date, round(row.seconds)) for row in
+               db.query(DailyRollup).filter(DailyRollup.task_id == task_id)}
+    assert sum(seconds for _, seconds in stopped) == pytest.approx(31 * 3600, abs=2)
+    assert len(stopped) in (2, 3)
+    assert all(row.activity_id == activity_id for row in
+               db.query(DailyRollup).filter(DailyRollup.task_id == task_id))
+
+    rebuild_daily_rollups(db, [task_id])
+    db.commit()
+    rebuilt = {(row.date, round(row.seconds)) for row in
+               db.query(DailyRollup).filter(DailyRollup.task_id == task_id)}
+    assert rebuilt == stopped
+    db.close()
+
+def test_import_and_export_time_entries():
+    response = client.post("/api/activities/", json={"name": "Import", "original_estimate": 10.0})
+    activity_id = response.json()["activity_id"]
+    response = client.post("/api/tasks/", json={"activity_id": activity_id, "name": "Import task"})
+    task_id = response.json()["task_id"]
+
+    content = "\n".join([
+        "task_id,start_time,end_time",
+        f"{task_id},2023-02-01T09:00:00,2023-02-01T10:30:00",
+        f"{task_id},2023-02-01T23:00:00,2023-02-02T01:00:00",
+        f"{task_id},2023-02-03T09:00:00,2023-02-03T08:00:00",
+        f"{task_id},not a date,2023-02-03T08:00:00",
+        "999999,2023-02-03T09:00:00,2023-02-03T10:00:00",
+    ])
+    response = client.post("/api/time_entries/import",
+                           files={"file": ("entries.csv", content, "text/csv")})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["imported"] == 2
+    assert result["skipped"] == 3
+    assert [error["line"] for error in result["errors"]] == [4, 5, 6]
+
+    response = client.get(f"/api/tasks/{task_id}/")
+    assert response.json()["duration"] == 210
+    assert response.json()["start_time"] == "2023-02-01T09:00:00"
+    response = client.get(f"/api/activities/{activity_id}/")
+    assert response.json()["completed_hours"] == 3.5
+    response = client.get("/api/reports", params={"activity_id": activity_id})
+    assert [(row["period"], row["hours"]) for row in response.json()] == [
+        ("2023-02-01", 2.5), ("2023-02-02", 1.0)]
+
+    response = client.get("/api/time_entries/export", params={"task_id": task_id})
+    assert response.status_code == 200
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {"task_id": task_id, "start_time": "2023-02-01T09:00:00", "end_time": "2023-02-01T10:30:00"},
+        {"task_id": task_id, "start_time": "2023-02-01T23:00:00", "end_time": "2023-02-02T01:00:00"},
+    ]
+
+    response = client.get("/api/time_entries/export", params={"task_id": task_id, "format": "csv"})
+    assert response.text.splitlines()[0] == "task_id,start_time,end_time"
+    response = client.post("/api/time_entries/import", params={"format": "csv"},
+                           files={"file": ("export", response.text, "text/csv")})
+    assert response.json()["imported"] == 2
+    response = client.get(f"/api/activities/{activity_id}/")
+    assert response.json()["completed_hours"] == 7.0
+
+    response = client.get("/api/time_entries/export", params={"format": "xml"})
+    assert response.status_code == 400
+
+    # Finalized activities take no more time, as in batches.
+    client.put(f"/api/activities/{activity_id}/", json={
+        "name": "Import", "original_estimate": 10.0, "finalized": True,
+        "price_per_hour": 0.0, "money_received": False})
+    content = "task_id,start_time,end_time\n{},2023-02-05T09:00:00,2023-02-05T11:00:00".format(task_id)
+    response = client.post("/api/time_entries/import",
+                           files={"file": ("entries.csv", content, "text/csv")})
+    assert response.json()["imported"] == 0
+    assert response.json()["errors"] == [
+        {"line": 2, "message": "You can't add time to a task with finalized activity"}]
+    response = client.get(f"/api/activities/{activity_id}/")
+    assert response.json()["completed_hours"] == 7.0
+
+def test_import_that_stops_early_keeps_totals_of_committed_batches():
+    response = client.post("/api/activities/", json={"name": "Partial import", "original_estimate": 10.0})
+    activity_id = response.json()["activity_id"]
+    response = client.post("/api/tasks/", json={"activity_id": activity_id, "name": "Partial task"})
+    task_id = response.json()["task_id"]
+
+    lines = [b"task_id,start_time,end_time\n"] + [
+        "{},2023-05-0{}T09:00:00,2023-05-0{}T10:00:00\n".format(task_id, day, day).encode()
+        for day in range(1, 5)]
+    lines[4] = lines[4].replace(b"09:00", b"\xff9:00")
+    with TestingSessionLocal() as db:
+        result = import_time_entries(db, codecs.iterdecode(lines, "utf-8"), "csv", batch_size=2)
+    assert (result.imported, result.complete, result.line) == (2, False, 3)
+    assert [error.line for error in result.errors] == [4]
+
+    assert client.get(f"/api/tasks/{task_id}/").json()["duration"] == 120
+    assert client.get(f"/api/activities/{activity_id}/").json()["completed_hours"] == 2.0
+    response = client.get("/api/reports", params={"activity_id": activity_id})
+    assert [(row["period"], row["hours"]) for row in response.json()] == [
+        ("2023-05-01", 1.0), ("2023-05-02", 1.0)]
+
+def test_batch_runs_in_one_transaction():
+    response = client.post("/api/activities/", json={"name": "Batch", "original_estimate": 10.0})
+    activity_id = response.json()["activity_id"]
+    response = client.post("/api/tasks/", json={"activity_id": activity_id, "name": "Batch task"})
+    task_id = response.json()["task_id"]
+
+    operations = [
+        {"op": "create", "resource": "time_entry", "data": {
+            "task_id": task_id, "start_time": "2023-03-01T09:00:00", "end_time": "2023-03-01T10:00:00"}},
+        {"op": "create", "resource": "time_entry", "data": {
+            "task_id": task_id, "start_time": "2023-03-02T09:00:00", "end_time": "2023-03-02T09:30:00"}},
+        {"op": "update", "resource": "task", "id": task_id, "data": {"name": "Renamed"}},
+        {"op": "create", "resource": "task", "data": {"activity_id": activity_id, "name": "Second"}},
+    ]
+    response, commits = count_commits(lambda: client.post("/api/batch", json=operations))
+    assert response.status_code == 200
+    # The operations, then the activity's totals in a background job, run
+    # inline here.
+    assert commits == 2
+    results = response.json()
+    assert [result["status_code"] for result in results] == [201, 201, 200, 201]
+    assert results[2]["data"]["name"] == "Renamed"
+
+    response = client.get(f"/api/tasks/{task_id}/")
+    assert response.json()["duration"] == 90
+    assert response.json()["start_time"] == "2023-03-01T09:00:00"
+    response = client.get(f"/api/activities/{activity_id}/")
+    assert response.json()["completed_hours"] == 1.5
+    response = client.get("/api/reports", params={"activity_id": activity_id})
+    assert [(row["period"], row["hours"]) for row in response.json()] == [
+        ("2023-03-01", 1.0), ("2023-03-02", 0.5)]
+
+    time_entry_id = results[0]["data"]["time_entry_id"]
+    operations = [
+        {"op": "delete", "resource": "time_entry", "id": time_entry_id},
+        {"op": "delete", "resource": "task", "id": 999999},
+    ]
+    response = client.post("/api/batch", json=operations)
+    assert response.status_code == 404
+    assert response.json()["detail"] == {"index": 1, "detail": "Task not found"}
+    response = client.get(f"/api/time_entries/{time_entry_id}/")
+    assert response.status_code == 200
+    response = client.get(f"/api/activities/{activity_id}/")
+    assert response.json()["completed_hours"] == 1.5
+
+    response = client.post("/api/batch", json=[{"op": "update", "resource": "time_entry", "id": 1}])
+    assert response.status_code == 400
+
+def test_job_queue_coalesces_jobs_per_key():
+    calls = []
+    running = []
+    started = threading.Event()
+
+    def job(key):
+        def run(items):
+            assert key not in running
+            running.append(key)
+            started.set()
+            time.sleep(0.05)
+            running.remove(key)
+            calls.append((key, sorted(items)))
+        return run
+
+    jobs = JobQueue(workers=2, delay=10)
+    for index in range(10):
+        jobs.submit("a", job("a"), [index])
+    jobs.submit("b", job("b"))
+    assert jobs.stats()["pending"] == 2
+    assert jobs.flush(5)
+    assert sorted(calls) == [("a", list(range(10))), ("b", [])]
+
+    # A job submitted while one with the same key runs is not merged into
+    # it, and waits for it to finish.
+    jobs.delay = 0
+    started.clear()
+    jobs.submit("a", job("a"), [1])
+    assert started.wait(5)
+    jobs.submit("a", job("a"), [2])
+    # Waiting jobs are run on close.
+    jobs.delay = 10
+    jobs.submit("c", job("c"))
+    assert jobs.close(5)
+    assert [call for call in calls[2:] if call[0] == "a"] == [("a", [1]), ("a", [2])]
+    assert ("c", []) in calls
+    stats = jobs.stats()
+    assert (stats["processed"], stats["coalesced"], stats["failed"], stats["pending"]) == (5, 9, 0, 0)
+
+def test_batch_totals_are_recomputed_in_the_background(tmp_path):
+    settings = Settings(database_url="sqlite:///{}".format(tmp_path / "jobs.db"),
+                        static_directory=str(tmp_path / "missing"), log_format="text",
+                        job_delay=10)
+    migrate_engine = create_db_engine(settings)
+    migrate(migrate_engine)
+    migrate_engine.dispose()
+
+    application = create_app(settings)
+    with TestClient(application) as app_client:
+        activity_id = app_client.post(
+            "/api/activities/", json={"name": "Jobs", "original_estimate": 10.0}).json()["activity_id"]
+        task_id = app_client.post(
+            "/api/tasks/", json={"activity_id": activity_id, "name": "Jobs"}).json()["task_id"]
+        for day in range(1, 6):
+            response = app_client.post("/api/batch", json=[{
+                "op": "create", "resource": "time_entry", "data": {
+                    "task_id": task_id, "start_time": f"2023-04-0{day}T09:00:00",
+                    "end_time": f"2023-04-0{day}T10:00:00"}}])
+            assert response.status_code == 200
+
+        stats = app_client.get("/api/jobs").json()
+        assert (stats["pending"], stats["coalesced"], stats["processed"]) == (1, 4, 0)
+        assert app_client.get(f"/api/activities/{activity_id}/").json()["completed_hours"] == 0
+
+        assert application.state.jobs.flush(10)
+        assert app_client.get(f"/api/activities/{activity_id}/").json()["completed_hours"] == 5
+        assert app_client.get(f"/api/tasks/{task_id}/").json()["duration"] == 300
+        stats = app_client.get("/api/jobs").json()
+        assert (stats["pending"], stats["processed"], stats["failed"]) == (0, 1, 0)
+        lines = app_client.get("/metrics").text.splitlines()
+        assert "background_jobs_pending 0.0" in lines
+        assert "background_jobs_coalesced_total 4.0" in lines
+        assert "background_job_lag_seconds_count 1.0" in lines
+
+        # Jobs still waiting at shutdown are run before the engine is closed.
+        app_client.post("/api/batch", json=[{
+            "op": "create", "resource": "time_entry", "data": {
+                "task_id": task_id, "start_time": "2023-04-06T09:00:00",
+                "end_time": "2023-04-06T10:00:00"}}])
+
+    engine = create_db_engine(settings)
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql(
+            "SELECT completed_hours FROM activities").scalar() == 6
+    engine.dispose()
+
+def test_event_stream_publishes_changes():
+    response = client.post("/api/activities/", json={"name": "Events", "original_estimate": 1.0})
+    activity = response.json()
+    response = client.post("/api/tasks/", json={"activity_id": activity["activity_id"], "name": "Events task"})
+    task_id = response.json()["task_id"]
+
+    def change():
+        time_entry = client.post(f"/api/time_entries/{task_id}/start").json()
+        client.put(f"/api/time_entries/{time_entry['time_entry_id']}/stop")
+        client.put(f"/api/tasks/close/{task_id}/")
+        client.put(f"/api/activities/{activity['activity_id']}/", json={
+            "name": "Renamed", "original_estimate": 1.0, "completed_hours": 0.0,
+            "finalized": False, "price_per_hour": 10.0, "money_received": False})
+        return time_entry
+
+    async def collect():
+        broker = app.state.events
+        subscriber = broker.subscribe()
+        stream = stream_events(broker, subscriber)
+        assert await stream.__anext__() == b"retry: 3000\n\n"
+        time_entry = await asyncio.get_running_loop().run_in_executor(None, change)
+        chunks = [await stream.__anext__() for _ in range(4)]
+        await stream.aclose()
+        assert subscriber not in broker.subscribers
+        return time_entry, chunks
+
+    time_entry, chunks = asyncio.run(collect())
+    events = []
+    for chunk in chunks:
+        type, data = chunk.decode().strip().split("\n")
+        events.append((type[len("event: "):], json.loads(data[len("data: "):])))
+
+    assert [type for type, _ in events] == [
+        "time_entry.started", "time_entry.stopped", "task.closed", "activity.updated"]
+    assert events[0][1] == time_entry
+    assert events[1][1]["end_time"] is not None
+    assert events[2][1]["closed"] is True
+    assert events[3][1]["name"] == "Renamed"
+
+def test_read_cache_hits_and_invalidation():
+    cache = app.state.cache
+    response = client.post("/api/activities/", json={"name": "Cached", "original_estimate": 2.0})
+    activity_id = response.json()["activity_id"]
+    response = client.post("/api/activities/", json={"name": "Other cached", "original_estimate": 2.0})
+    other_id = response.json()["activity_id"]
+    response = client.post("/api/tasks/", json={"activity_id": activity_id, "name": "Cached task"})
+    task_id = response.json()["task_id"]
+    client.get(f"/api/tasks/activity/{other_id}/")
+
+    stats = cache.stats()
+    response = client.get(f"/api/activities/{activity_id}/")
+    assert client.get(f"/api/activities/{activity_id}/").json() == response.json()
+    assert client.get(f"/api/tasks/activity/{activity_id}/").json()[0]["name"] == "Cached task"
+    client.get(f"/api/tasks/activity/{activity_id}/")
+    assert cache.stats()["hits"] - stats["hits"] == 2
+    assert cache.stats()["misses"] - stats["misses"] == 2
+
+    # Cached values are not re-read from the database.
+    with TestingSessionLocal() as db:
+        db.query(Task).filter(Task.task_id == task_id).update({"name": "Changed behind"})
+        db.commit()
+    assert client.get(f"/api/tasks/activity/{activity_id}/").json()[0]["name"] == "Cached task"
+
+    # Writes drop the entries they affect, and only those.
+    client.put(f"/api/tasks/{task_id}/", json={"name": "Renamed task"})
+    assert ("tasks", other_id, None, None) in cache.entries
+    assert client.get(f"/api/tasks/activity/{activity_id}/").json()[0]["name"] == "Renamed task"
+
+    time_entry = client.post(f"/api/time_entries/{task_id}/start").json()
+    client.put(f"/api/time_entries/{time_entry['time_entry_id']}/stop")
+    assert ("activity", activity_id) not in cache.entries
+    assert ("tasks", other_id, None, None) in cache.entries
+
+    response = client.get("/api/cache")
+    assert response.status_code == 200
+    assert set(response.json()) == {"hits", "misses", "size", "maxsize"}
+
+def test_read_cache_drops_values_loaded_before_an_invalidation():
+    cache = ReadCache(maxsize=2, ttl=60)
+    generation = cache.generation
+    cache.invalidate(("activity", 1))
+    cache.set(("activity", 1), {"name": "stale"}, generation)
+    assert cache.get(("activity", 1)) is None
+
+    for activity_id in range(3):
+        cache.set(("activity", activity_id), {}, cache.generation)
+    assert list(cache.entries) == [("activity", 1), ("activity", 2)]
+
+    cache = ReadCache(ttl=0)
+    cache.set(("activity", 1), {}, cache.generation)
+    assert cache.get(("activity", 1)) is None
+
+def test_read_cache_is_off_with_several_workers_unless_configured(monkeypatch):
+    assert create_app(Settings()).state.cache.maxsize == 1024
+    assert create_app(Settings(workers=2)).state.cache.maxsize == 0
+    assert create_app(Settings(workers=2, cache_size=100)).state.cache.maxsize == 100
+
+    # A worker started by `uvicorn --workers`.
+    monkeypatch.setattr("multiprocessing.parent_process", lambda: object())
+    assert create_app(Settings()).state.cache.maxsize == 0
+
+def test_etags_and_not_modified():
+    response = client.post("/api/activities/", json={"name": "ETag", "original_estimate": 2.0})
+    activity_id = response.json()["activity_id"]
+    response = client.post("/api/tasks/", json={"activity_id": activity_id, "name": "ETag task"})
+    task_id = response.json()["task_id"]
+
+    urls = [f"/api/activities/{activity_id}/", f"/api/tasks/{task_id}/",
+            f"/api/tasks/activity/{activity_id}/", f"/api/time_entries/task/{task_id}/"]
+    etags = {}
+    for url in urls:
+        response = client.get(url)
+        etags[url] = response.headers["ETag"]
+        assert etags[url].startswith('W/"')
+        app.state.cache.clear()
+        response = client.get(url, headers={"If-None-Match": etags[url]})
+        assert response.status_code == 304
+        assert response.content == b""
+        response = client.get(url, headers={"If-None-Match": 'W/"other"'})
+        assert response.status_code == 200
+
+    # Stopping an entry bumps the task and activity versions through the
+    # rollup UPDATE statements.
+    time_entry = client.post(f"/api/time_entries/{task_id}/start").json()
+    client.put(f"/api/time_entries/{time_entry['time_entry_id']}/stop")
+    for url in urls:
+        response = client.get(url, headers={"If-None-Match": etags[url]})
+        assert response.status_code == 200, url
+        assert response.headers["ETag"] != etags[url]
+
+    url = f"/api/time_entries/{time_entry['time_entry_id']}/"
+    etag = client.get(url).headers["ETag"]
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    response = client.get("/api/time_entries/999999/", headers={"If-None-Match": etag})
+    assert response.status_code == 404
+
+    with TestingSessionLocal() as db:
+        task = db.query(Task).get(task_id)
+        version = task.version
+        task.name = "Renamed"
+        db.commit()
+        assert task.version == version + 1
+
+def test_search_names():
+    response = client.post("/api/activities/", json={"name": "Quokka website redesign", "original_estimate": 1.0})
+    activity_id = response.json()["activity_id"]
+    client.post("/api/tasks/", json={"activity_id": activity_id, "name": "Quokka logo"})
+    response = client.post("/api/tasks/", json={"activity_id": activity_id, "name": "Landing page"})
+    task_id = response.json()["task_id"]
+
+    response = client.get("/api/search", params={"q": "quok"})
+    assert response.status_code == 200
+    assert {(result["type"], result["name"]) for result in response.json()} == {
+        ("activity", "Quokka website redesign"), ("task", "Quokka logo")}
+
+    response = client.get("/api/search", params={"q": "quokka re", "type": "activity"})
+    assert [result["id"] for result in response.json()] == [activity_id]
+    response = client.get("/api/search", params={"q": "quokka", "limit": 1})
+    assert len(response.json()) == 1
+
+    # The index follows renames and deletions.
+    client.put(f"/api/tasks/{task_id}/", json={"name": "Quokka landing page"})
+    response = client.get("/api/search", params={"q": "quokka land"})
+    assert [(result["type"], result["id"]) for result in response.json()] == [("task", task_id)]
+    client.delete(f"/api/tasks/{task_id}/")
+    assert client.get("/api/search", params={"q": "quokka land"}).json() == []
+
+    # Tasks outlive their activity.
+    client.delete(f"/api/activities/{activity_id}/")
+    response = client.get("/api/search", params={"q": "quokka"})
+    assert response.status_code == 200
+    assert [(result["type"], result["activity_id"]) for result in response.json()] == [("task", None)]
+
+    # FTS5 syntax in the input is not interpreted.
+    assert client.get("/api/search", params={"q": 'quokka" OR "x'}).status_code == 200
+    assert client.get("/api/search", params={"q": "-*"}).json() == []
+
+@pytest.fixture
+def count_queries():
+    """
+    List of the SQL statements executed on the test engine.
+    """
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    yield statements
+    event.remove(engine, "before_cursor_execute", listener)
+
+def test_endpoints_run_a_bounded_number_of_queries(count_queries):
+    response = client.post("/api/activities/", json={"name": "Queries", "original_estimate": 5.0})
+    activity_id = response.json()["activity_id"]
+    task_ids = [client.post("/api/tasks/", json={"activity_id": activity_id, "name": f"Queries {i}"}).json()["task_id"]
+                for i in range(5)]
+    task_id = task_ids[0]
+    for other_task_id in task_ids:
+        for _ in range(3):
+            time_entry = client.post(f"/api/time_entries/{other_task_id}/start").json()
+            client.put(f"/api/time_entries/{time_entry['time_entry_id']}/stop")
+    time_entry_id = client.post(f"/api/time_entries/{task_id}/start").json()["time_entry_id"]
+    entry = {"task_id": task_id, "start_time": "2023-04-01T09:00:00", "end_time": "2023-04-01T10:00:00"}
+    activity_update = {"name": "Queries", "original_estimate": 5.0, "completed_hours": 0.0,
+                       "finalized": False, "price_per_hour": 1.0, "money_received": False}
+
+    # (method, path, request, maximum statements). Every endpoint is listed,
+    # and the bounds don't depend on the number of rows involved.
+    cases = [
+        ("GET", "/api/activities/", lambda: client.get("/api/activities/"), 1),
+        ("GET", "/api/activities/stream", lambda: client.get("/api/activities/stream"), 1),
+        ("GET", "/api/activities/{activity_id}/", lambda: client.get(f"/api/activities/{activity_id}/"), 1),
+        ("PUT", "/api/activities/{activity_id}/",
+         lambda: client.put(f"/api/activities/{activity_id}/", json=activity_update), 3),
+        ("GET", "/api/tasks/activity/{activity_id}/", lambda: client.get(f"/api/tasks/activity/{activity_id}/"), 1),
+        ("GET", "/api/tasks/{task_id}/", lambda: client.get(f"/api/tasks/{task_id}/"), 1),
+        ("PUT", "/api/tasks/{task_id}/", lambda: client.put(f"/api/tasks/{task_id}/", json={"name": "Renamed"}), 3),
+        ("GET", "/api/time_entries/task/{task_id}/", lambda: client.get(f"/api/time_entries/task/{task_id}/"), 1),
+        ("GET", "/api/time_entries/task/{task_id}/stream",
+         lambda: client.get(f"/api/time_entries/task/{task_id}/stream"), 1),
+        ("GET", "/api/time_entries/task/{task_id}/playing",
+         lambda: client.get(f"/api/time_entries/task/{task_id}/playing"), 2),
+        ("GET", "/api/time_entries/{time_entry_id}/", lambda: client.get(f"/api/time_entries/{time_entry_id}/"), 1),
+        ("PUT", "/api/time_entries/{time_entry_id}/stop",
+         lambda: client.put(f"/api/time_entries/{time_entry_id}/stop"), 6),
+        ("POST", "/api/time_entries/{task_id}/start", lambda: client.post(f"/api/time_entries/{task_id}/start"), 3),
+        ("GET", "/api/time_entries/export", lambda: client.get("/api/time_entries/export"), 1),
+        ("POST", "/api/time_entries/import", lambda: client.post(
+            "/api/time_entries/import",
+            files={"file": ("entries.csv", "task_id,start_time,end_time\n{},{},{}\n".format(
+                task_id, entry["start_time"], entry["end_time"]), "text/csv")}), 7),
+        ("GET", "/api/reports", lambda: client.get("/api/reports"), 1),
+        ("GET", "/api/search", lambda: client.get("/api/search", params={"q": "queries"}), 2),
+        ("POST", "/api/batch", lambda: client.post("/api/batch", json=[
+            {"op": "create", "resource": "time_entry", "data": entry},
+            {"op": "update", "resource": "task", "id": task_id, "data": {"name": "Batch"}}]), 12),
+        ("GET", "/api/cache", lambda: client.get("/api/cache"), 0),
+        ("GET", "/api/jobs", lambda: client.get("/api/jobs"), 0),
+        ("POST", "/api/activities/", lambda: client.post(
+            "/api/activities/", json={"name": "New", "original_estimate": 1.0}), 2),
+        ("POST", "/api/tasks/", lambda: client.post(
+            "/api/tasks/", json={"activity_id": activity_id, "name": "New"}), 3),
+        ("PUT", "/api/tasks/close/{task_id}/", lambda: client.put(f"/api/tasks/close/{task_ids[1]}/"), 3),
+        ("DELETE", "/api/tasks/{task_id}/", lambda: client.delete(f"/api/tasks/{task_ids[2]}/"), 5),
+        ("DELETE", "/api/activities/{activity_id}/", lambda: client.delete(f"/api/activities/{activity_id}/"), 4),
+        ("GET", "/api/docs", lambda: client.get("/api/docs"), 0),
+        ("GET", "/metrics", lambda: client.get("/metrics"), 0),
+        ("GET", "/api/openapi.json", lambda: client.get("/api/openapi.json"), 0),
+    ]
+
+    routes = {(method, route.path) for route in app.routes if isinstance(route, APIRoute)
+              for method in route.methods}
+    # The event stream never ends, see test_event_stream_publishes_changes.
+    routes.discard(("GET", "/api/events"))
+    assert routes == {(method, path) for method, path, _, _ in cases}
+
+    for method, path, request, maximum in cases:
+        app.state.cache.clear()
+        count_queries.clear()
+        response = request()
+        assert response.status_code < 400, (path, response.text)
+        statements = [statement for statement in count_queries
+                      if not statement.startswith(("BEGIN", "COMMIT", "ROLLBACK"))]
+        assert len(statements) <= maximum, (method, path, statements)
+
+def test_metrics_endpoint(tmp_path):
+    settings = Settings(database_url="sqlite:///{}".format(tmp_path / "metrics.db"),
+                        static_directory=str(tmp_path / "missing"), log_format="text")
+    migrate_engine = create_db_engine(settings)
+    migrate(migrate_engine)
+    migrate_engine.dispose()
+
+    with TestClient(create_app(settings)) as app_client:
+        response = app_client.post("/api/activities/", json={"name": "Metrics", "original_estimate": 1.0})
+        activity_id = response.json()["activity_id"]
+        app_client.get(f"/api/activities/{activity_id}/")
+        app_client.get(f"/api/activities/{activity_id}/")
+        response = app_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    assert "# TYPE http_request_duration_seconds histogram" in lines
+    assert 'http_request_duration_seconds_count{method="GET",route="/api/activities/{activity_id}/",status="200"} 2.0' in lines
+    assert 'http_request_duration_seconds_bucket{method="POST",route="/api/activities/",status="201",le="+Inf"} 1.0' in lines
+    # One query for the first read, none for the cached one.
+    assert 'http_request_sql_statements_sum{route="/api/activities/{activity_id}/"} 1.0' in lines
+    assert "db_commits_total 1.0" in lines
+    assert "read_cache_hits_total 1.0" in lines
+    assert "db_pool_checked_out 0.0" in lines
+    assert any(line.startswith("sql_statements_total ") for line in lines)
+
+def test_json_log_format():
+    formatter = JsonFormatter()
+    record = logging.LogRecord("time_tracker.requests", logging.WARNING, __file__, 1,
+                               "slow request", None, None)
+    record.fields = {"route": "/api/reports", "duration": 1.5}
+    entry = json.loads(formatter.format(record))
+    assert entry["message"] == "slow request"
+    assert entry["level"] == "WARNING"
+    assert entry["route"] == "/api/reports"
+    assert entry["duration"] == 1.5
+
 # Run all tests
 if __name__ == '__main__':
     pytest.main()
@@ -0,0 +1,113 @@
+import pytest
+from sqlalchemy import inspect
+
+from database import Base, create_db_engine
+from migrations import MIGRATIONS, check_schema_version, get_latest_version, migrate, schema_version
+from settings import Settings
+
+
+def get_engine(path):
+    return create_db_engine(Settings(database_url="sqlite:///{}".format(path)))
+
+
+def describe_schema(engine):
+    inspector = inspect(engine)
+    schema = {}
+    for table in inspector.get_table_names():
+        if table == "schema_version":
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table)}
+        indexes = {index["name"] for index in inspector.get_indexes(table)}
+        schema[table] = (columns, indexes)
+    return schema
+
+
+def test_migrations_match_models(tmp_path):
+    migrated = get_engine(tmp_path / "migrated.db")
+    assert migrate(migrated) == list(range(1, get_latest_version() + 1))
+
+    created = get_engine(tmp_path / "created.db")
+    Base.metadata.create_all(bind=created)
+
+    assert describe_schema(migrated) == describe_schema(created)
+    migrated.dispose()
+    created.dispose()
+
+
+def test_migrate_adopts_unversioned_database(tmp_path):
+    engine = get_engine(tmp_path / "old.db")
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE activities (activity_id INTEGER PRIMARY KEY, name VARCHAR(255), "
+            "original_estimate FLOAT, remaining_hours FLOAT, completed_hours FLOAT, "
+            "finalized BOOLEAN, price_per_hour FLOAT, money_received BOOLEAN)")
+        connection.exec_driver_sql(
+            "INSERT INTO activities (name, original_estimate) VALUES ('Kept', 1.0)")
+
+    migrate(engine)
+
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("SELECT name FROM activities").scalar() == "Kept"
+    index_names = {index["name"] for index in inspect(engine).get_indexes("tasks")}
+    assert "ix_tasks_activity_id" in index_names
+    assert migrate(engine) == []
+    engine.dispose()
+
+
+def test_check_schema_version(tmp_path):
+    engine = get_engine(tmp_path / "check.db")
+    with pytest.raises(RuntimeError, match="manage.py migrate"):
+        check_schema_version(engine)
+
+    migrate(engine)
+    check_schema_version(engine)
+    engine.dispose()
+
+
+def test_migrate_backfills_daily_rollups(tmp_path):
+    engine = get_engine(tmp_path / "history.db")
+    with engine.begin() as connection:
+        for version, upgrade in MIGRATIONS:
+            if version < 3:
+                upgrade(connection)
+        connection.exec_driver_sql(
+            "INSERT INTO activities (activity_id, name, original_estimate) VALUES (1, 'Old', 1.0)")
+        connection.exec_driver_sql(
+            "INSERT INTO tasks (task_id, activity_id, name, duration) VALUES (1, 1, 'Old', 0)")
+        connection.exec_driver_sql(
+            "INSERT INTO time_entries (task_id, start_time, end_time, duration) VALUES "
+            "(1, '2023-01-01 23:00:00.000000', '2023-01-02 01:00:00.000000', 7200)")
+
+    migrate(engine)
+
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(
+            "SELECT activity_id, date, seconds FROM daily_rollups ORDER BY date").fetchall()
+    assert [tuple(row) for row in rows] == [(1, "2023-01-01", 3600.0), (1, "2023-01-02", 3600.0)]
+    engine.dispose()
+
+
+def test_migrate_keeps_one_running_entry_per_task(tmp_path):
+    engine = get_engine(tmp_path / "running.db")
+    with engine.begin() as connection:
+        for version, upgrade in MIGRATIONS:
+            if version < 6:
+                upgrade(connection)
+        schema_version.create(bind=connection)
+        connection.execute(schema_version.insert().values(version=5))
+        connection.exec_driver_sql(
+            "INSERT INTO activities (activity_id, name, original_estimate) VALUES (1, 'Old', 1.0)")
+        connection.exec_driver_sql(
+            "INSERT INTO tasks (task_id, activity_id, name, duration) VALUES (1, 1, 'Old', 0)")
+        connection.exec_driver_sql(
+            "INSERT INTO time_entries (time_entry_id, task_id, start_time) VALUES "
+            "(1, 1, '2023-01-01 10:00:00.000000'), (2, 1, '2023-01-01 10:00:01.000000')")
+
+    migrate(engine)
+
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(
+            "SELECT time_entry_id, end_time, duration FROM time_entries ORDER BY 1").fetchall()
+    assert [tuple(row) for row in rows] == [
+        (1, "2023-01-01 10:00:00.000000", 0.0), (2, None, None)]
+    engine.dispose()
@@ -0,0 +1,183 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+from fastapi.testclient import TestClient
+from sqlalchemy import MetaData
+
+from database import create_db_engine
+from main import create_app
+from migrations import migrate
+from rollups import refresh_activity
+from settings import Settings
+
+# Run against PostgreSQL when TIME_TRACKER_TEST_DATABASE_URL points at an
+# empty database, e.g. one in a local container. Its tables are dropped
+# before and after each test.
+DATABASE_URL = os.environ.get("TIME_TRACKER_TEST_DATABASE_URL", "")
+
+pytestmark = pytest.mark.skipif(
+    not DATABASE_URL.startswith("postgresql"),
+    reason="TIME_TRACKER_TEST_DATABASE_URL is not a PostgreSQL database")
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def drop_all(engine):
+    metadata = MetaData()
+    metadata.reflect(bind=engine)
+    metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def engine():
+    engine = create_db_engine(Settings(database_url=DATABASE_URL))
+    drop_all(engine)
+    migrate(engine)
+    yield engine
+    drop_all(engine)
+    engine.dispose()
+
+
+def get_totals(engine):
+    with engine.connect() as connection:
+        return connection.exec_driver_sql(
+            "SELECT (SELECT sum(duration) FROM time_entries), "
+            "(SELECT sum(duration) * 60 FROM tasks), "
+            "(SELECT sum(completed_hours) * 3600 FROM activities), "
+            "(SELECT sum(seconds) FROM daily_rollups)").one()
+
+
+def test_postgres_endpoints(engine):
+    settings = Settings(database_url=DATABASE_URL, log_format="text")
+    with TestClient(create_app(settings)) as client:
+        activity_id = client.post(
+            "/api/activities/", json={"name": "Postgres", "original_estimate": 10.0}
+        ).json()["activity_id"]
+        task_id = client.post(
+            "/api/tasks/", json={"activity_id": activity_id, "name": "Postgres task"}
+        ).json()["task_id"]
+
+        assert client.post(f"/api/time_entries/{task_id}/start").status_code == 200
+        assert client.post(f"/api/time_entries/{task_id}/start").status_code == 409
+        time_entry_id = client.get(
+            f"/api/time_entries/task/{task_id}/playing").json()["time_entry_id"]
+        stopped = client.put(f"/api/time_entries/{time_entry_id}/stop").json()
+        assert client.put(f"/api/time_entries/{time_entry_id}/stop").json() == stopped
+
+        for bucket in ["day", "week", "month"]:
+            response = client.get(f"/api/reports?bucket={bucket}")
+            assert response.status_code == 200
+            assert [row["activity_id"] for row in response.json()] == [activity_id]
+        response = client.get("/api/search?q=postg")
+        assert {(result["type"], result["id"]) for result in response.json()} == {
+            ("activity", activity_id), ("task", task_id)}
+
+        assert client.delete(f"/api/activities/{activity_id}/").status_code == 200
+
+    seconds, task_seconds, _, rollup_seconds = get_totals(engine)
+    assert task_seconds == pytest.approx(seconds)
+    assert rollup_seconds == pytest.approx(seconds)
+
+
+def get_free_port():
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+
+
+@pytest.fixture
+def server(engine):
+    port = get_free_port()
+    env = dict(os.environ, TIME_TRACKER_DATABASE_URL=DATABASE_URL, TIME_TRACKER_PORT=str(port),
+               TIME_TRACKER_WORKERS="2", TIME_TRACKER_LOG_LEVEL="WARNING")
+    process = subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = "http://127.0.0.1:{}".format(port)
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            requests.get(url + "/api/cache", timeout=1)
+            break
+        except requests.ConnectionError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError("server did not start")
+            time.sleep(0.2)
+    yield url
+    process.terminate()
+    process.wait(30)
+
+
+def test_workers_keep_one_running_entry_and_consistent_rollups(engine, server):
+    activity_id = requests.post(server + "/api/activities/", json={
+        "name": "Workers", "original_estimate": 10.0}).json()["activity_id"]
+    task_ids = [requests.post(server + "/api/tasks/", json={
+        "activity_id": activity_id, "name": "Task {}".format(index)}).json()["task_id"]
+        for index in range(4)]
+
+    def start_and_stop(task_id):
+        with ThreadPoolExecutor(4) as executor:
+            for _ in range(5):
+                responses = list(executor.map(
+                    lambda _: requests.post(server + f"/api/time_entries/{task_id}/start"),
+                    range(4)))
+                assert sorted(response.status_code for response in responses) == [200, 409, 409, 409]
+                time_entry_id = next(response.json()["time_entry_id"]
+                                     for response in responses if response.status_code == 200)
+                responses = list(executor.map(
+                    lambda _: requests.put(server + f"/api/time_entries/{time_entry_id}/stop"),
+                    range(4)))
+                assert {response.status_code for response in responses} == {200}
+                assert len({response.json()["end_time"] for response in responses}) == 1
+
+    with ThreadPoolExecutor(len(task_ids)) as executor:
+        list(executor.map(start_and_stop, task_ids))
+
+    with engine.connect() as connection:
+        counts = connection.exec_driver_sql(
+            "SELECT count(*), count(end_time) FROM time_entries").one()
+    assert tuple(counts) == (20, 20)
+    seconds, task_seconds, activity_seconds, rollup_seconds = get_totals(engine)
+    assert task_seconds == pytest.approx(seconds)
+    assert activity_seconds == pytest.approx(seconds)
+    assert rollup_seconds == pytest.approx(seconds)
+
+
+def test_background_refresh_does_not_lose_concurrent_stops(engine):
+    settings = Settings(database_url=DATABASE_URL, log_format="text", log_level="WARNING",
+                        pool_size=10)
+    with TestClient(create_app(settings)) as client:
+        activity_id = client.post("/api/activities/", json={
+            "name": "Refresh", "original_estimate": 10.0}).json()["activity_id"]
+        task_ids = [client.post("/api/tasks/", json={
+            "activity_id": activity_id, "name": "Task {}".format(index)}).json()["task_id"]
+            for index in range(4)]
+        done = threading.Event()
+
+        def start_and_stop(task_id):
+            for _ in range(10):
+                time_entry_id = client.post(
+                    f"/api/time_entries/{task_id}/start").json()["time_entry_id"]
+                client.put(f"/api/time_entries/{time_entry_id}/stop")
+
+        def refresh():
+            while not done.is_set():
+                refresh_activity(engine, activity_id, task_ids)
+
+        with ThreadPoolExecutor(len(task_ids) + 1) as executor:
+            refreshing = executor.submit(refresh)
+            list(executor.map(start_and_stop, task_ids))
+            done.set()
+            refreshing.result()
+
+    seconds, task_seconds, activity_seconds, rollup_seconds = get_totals(engine)
+    assert task_seconds == pytest.approx(seconds)
+    assert activity_seconds == pytest.approx(seconds)
+    assert rollup_seconds == pytest.approx(seconds)
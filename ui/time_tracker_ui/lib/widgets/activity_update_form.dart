@@ -56,11 +56,12 @@ class _ActivityUpdateFormState extends State<ActivityUpdateForm> {
             keyboardType: const TextInputType.numberWithOptions(decimal: true),
           ),
           const SizedBox(height: 16.0),
+          // Completed hours come from the time entries; the server ignores
+          // the value sent back.
           TextFormField(
             controller: _completedHoursController,
             decoration: const InputDecoration(labelText: 'Completed Hours'),
-            inputFormatters: [DecimalTextInputFormatter(decimalRange: 2)],
-            keyboardType: const TextInputType.numberWithOptions(decimal: true),
+            readOnly: true,
           ),
           const SizedBox(height: 16.0),
           TextFormField(